@@ -1,13 +1,78 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 from datetime import datetime, timedelta
+import base64
 import json
+import os
+import sys
 import time
-import hashlib
-from auth import authenticate_user, change_password, get_user_info
+from typing import Final
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import orjson  # Optional - faster credentials.json reads/writes
+except ImportError:
+    orjson = None
+from auth import authenticate_user, change_password, get_user_info, hash_password_scrypt, load_credentials, update_credentials
+import gspread
+import requests
+import google.auth.exceptions
 from sheets_manager import SheetsManager
+from rate_limiter import allow_action
+from session_store import create_session, refresh_session, delete_session
 from utils import calculate_currency_status, format_status_badge
-from optimization import session_cache, clear_session_cache, lazy_load_data, optimize_dataframe
+from optimization import session_cache, clear_session_cache, lazy_load_data, optimize_dataframe, display_dataframe_quickly, top_k_rows
+
+# Precompiled HTML card templates for the team overview action lists
+format_critical_card = '<div class="action-item-critical"><strong>{rank} {name}</strong><br><small>{vehicle} • {km:.1f} KM (3mo)</small></div>'.format
+format_expiring_card = '<div class="action-item-warning"><strong>{rank} {name}</strong><br><small>{vehicle} • Expires in {days} days</small></div>'.format
+format_platoon_critical_card = '<div class="action-item-critical" style="margin: 5px 0;"><strong>{rank} {name}</strong> ({vehicle}) - {km:.1f} KM in last 3 months</div>'.format
+format_platoon_expiring_card = '<div class="action-item-warning" style="margin: 5px 0;"><strong>{rank} {name}</strong> ({vehicle}) - Expires in {days} days</div>'.format
+format_strength_card = '<div class="action-item-warning" style="background-color: #d4edda; color: #155724; border-left: 4px solid #28a745;"><strong>{rank} {name}</strong><br><small>Max: {weight:.1f}kg{progress}</small></div>'.format
+format_sessions_card = '<div class="action-item-warning" style="background-color: #d1ecf1; color: #0c5460; border-left: 4px solid #17a2b8;"><strong>{rank} {name}</strong><br><small>{sessions} sessions completed</small></div>'.format
+format_pr_card = '<div class="action-item-warning" style="background-color: #fff3cd; color: #856404; border-left: 4px solid #ffc107;"><strong>{rank} {name}</strong><br><small>{prs} PRs this month</small></div>'.format
+format_support_card = '<div class="action-item-critical"><strong>{rank} {name}</strong><br><small>No recent training sessions</small></div>'.format
+
+# Session cookie holding the opaque token - read server-side via st.context.cookies
+_SESSION_COOKIE: Final[str] = "msc_drivr_session"
+
+# Browser storage snippets for login/logout - the token is JSON-encoded when formatted.
+# st.context.cookies is read-only, so the cookie is still written from the page
+_LOGIN_STORAGE_JS: Final[str] = """
+<script>
+window.parent.document.cookie = '{cookie}=' + {token} + '; max-age={max_age}; path=/; SameSite=Strict'
+    + (window.parent.location.protocol === 'https:' ? '; Secure' : '');
+</script>
+"""
+
+_LOGOUT_STORAGE_JS: Final[str] = """
+<script>
+window.parent.document.cookie = 'msc_drivr_session=; max-age=0; path=/; SameSite=Strict';
+localStorage.removeItem('msc_drivr_logged_in');
+localStorage.removeItem('msc_drivr_username');
+localStorage.removeItem('msc_drivr_session_token');
+localStorage.removeItem('msc_drivr_expires_at');
+localStorage.removeItem('msc_drivr_login_time');
+sessionStorage.clear();
+</script>
+"""
+
+# Dashboard card emoji and label per vehicle type, in display order
+_VEHICLE_META: Final[dict] = {
+    'terrex': ('🚛', 'TERREX'),
+    'belrex': ('🚗', 'BELREX'),
+}
+
+# Static currency rules shown under the vehicle status on the currency tab
+_CURRENCY_RULES_MD: Final[str] = """
+**Currency Rules:**
+- ✅ **Current:** 2.0 KM or more driven in the last 3 months
+- ❌ **Not Current:** Less than 2.0 KM driven in the last 3 months
+- **Expiry:** Currency expires 3 months after last 2.0 KM cumulative drive
+"""
+
+# Shown in place of an action the rate limiter rejected
+_RATE_LIMITED_MSG: Final[str] = "🚫 Too many requests. Please wait a few seconds and try again."
 
 # Performance optimization - Streamlit configuration
 if "app_configured" not in st.session_state:
@@ -32,92 +97,24 @@ if "app_configured" not in st.session_state:
 # High-load performance functions
 def configure_high_load_performance():
     """Configure app for 90+ concurrent users"""
-    from collections import defaultdict
-    
-    # Initialize rate limiting and monitoring
-    if 'rate_limits' not in st.session_state:
-        st.session_state.rate_limits = defaultdict(list)
-    
-    if 'load_monitor' not in st.session_state:
-        st.session_state.load_monitor = {
-            'request_times': [],
-            'active_users': set(),
-            'last_check': time.time(),
-            'high_load_mode': False
-        }
-    
-    # Check if we should enable high load mode
-    check_and_enable_high_load_mode()
-    
     # Aggressive memory cleanup
     cleanup_session_memory()
 
-def check_and_enable_high_load_mode():
-    """Automatically detect high load and enable protection"""
-    import time
-    current_time = time.time()
-    
-    # Track this user as active
-    if 'username' in st.session_state:
-        st.session_state.load_monitor['active_users'].add(st.session_state['username'])
-    
-    # Clean old active users (remove after 5 minutes of inactivity)
-    if current_time - st.session_state.load_monitor['last_check'] > 30:  # Check every 30 seconds
-        # Count recent requests across all users
-        total_recent_requests = 0
-        for user_requests in st.session_state.rate_limits.values():
-            recent_requests = [req for req in user_requests if current_time - req < 300]  # Last 5 minutes
-            total_recent_requests += len(recent_requests)
-        
-        # Count concurrent users (active in last 5 minutes)
-        concurrent_users = len(st.session_state.load_monitor['active_users'])
-        
-        # Enable high load mode if:
-        # - More than 50 concurrent users OR
-        # - More than 200 requests in last 5 minutes OR
-        # - Average response time getting slow
-        should_enable = (
-            concurrent_users > 50 or 
-            total_recent_requests > 200
-        )
-        
-        if should_enable and not st.session_state.load_monitor['high_load_mode']:
-            st.session_state.load_monitor['high_load_mode'] = True
-            st.session_state.high_load_mode = True
-            st.warning("⚡ High load detected - Performance protection enabled")
-        
-        elif not should_enable and st.session_state.load_monitor['high_load_mode']:
-            st.session_state.load_monitor['high_load_mode'] = False
-            st.session_state.high_load_mode = False
-            st.success("✅ Load normalized - Full performance restored")
-        
-        st.session_state.load_monitor['last_check'] = current_time
-
-def check_rate_limit(user_id):
-    """Prevent system overload with rate limiting"""
-    import time
-    current_time = time.time()
-    
-    if 'rate_limits' not in st.session_state:
-        st.session_state.rate_limits = defaultdict(list)
-    
-    user_requests = st.session_state.rate_limits[user_id]
-    
-    # Remove old requests (1 minute window)
-    user_requests[:] = [req_time for req_time in user_requests 
-                       if current_time - req_time < 60]
-    
-    # Allow max 20 requests per minute per user (much more reasonable)
-    if len(user_requests) >= 20:
-        st.warning("⏳ Please wait a moment before making another request.")
-        return False
+def check_rate_limit():
+    """Gate an expensive action (Sheets write, upload) for this login session; shows an error when throttled"""
+    if allow_action(st.session_state.get('username', 'unknown'), st.session_state.get('session_token')):
+        return True
     
-    user_requests.append(current_time)
-    return True
+    st.error(_RATE_LIMITED_MSG)
+    return False
 
-def cleanup_session_memory():
-    """Aggressive memory cleanup for high-load scenarios"""
-    import sys
+def cleanup_session_memory(min_interval=15.0):
+    """Aggressive memory cleanup for high-load scenarios - runs at most once per min_interval seconds per session"""
+    # Every widget interaction reruns the script, so skip cleanup between intervals
+    now = time.monotonic()
+    if now - st.session_state.get('_last_cleanup', 0.0) < min_interval:
+        return
+    st.session_state._last_cleanup = now
     
     # Clean expired session cache
     if 'session_cache' in st.session_state:
@@ -176,43 +173,18 @@ if 'credentials_checked' not in st.session_state:
 
 
 
+@st.cache_resource(show_spinner=False)
+def load_css(name):
+    """Read a stylesheet from static/ once per server process"""
+    with open(os.path.join("static", name), "r") as f:
+        return f"<style>\n{f.read()}</style>"
+
+def inject_css(name):
+    """Emit a cached stylesheet - must run on every rerun or Streamlit drops the element"""
+    st.markdown(load_css(name), unsafe_allow_html=True)
+
 # Add custom CSS for permanent sidebar on laptops
-st.markdown("""
-<style>
-    /* Force sidebar to stay open on laptops and desktops */
-    @media (min-width: 768px) {
-        /* Sidebar container */
-        section[data-testid="stSidebar"] {
-            width: 320px !important;
-            min-width: 320px !important;
-            transform: translateX(0px) !important;
-            visibility: visible !important;
-        }
-        
-        /* Sidebar content */
-        .css-1d391kg, .css-6qob1r, .st-emotion-cache-6qob1r {
-            width: 320px !important;
-            min-width: 320px !important;
-        }
-        
-        /* Main content area adjustment */
-        .main .block-container, .css-1lcbmhc {
-            margin-left: 340px !important;
-            max-width: calc(100% - 360px) !important;
-        }
-        
-        /* Hide collapse button */
-        button[data-testid="collapsedControl"] {
-            display: none !important;
-        }
-        
-        /* Override any auto-hide behavior */
-        .css-79elbk, .css-1kyxreq {
-            display: none !important;
-        }
-    }
-</style>
-""", unsafe_allow_html=True)
+inject_css("app.css")
 
 # Initialize session state with persistence
 def init_session_state():
@@ -226,12 +198,6 @@ def init_session_state():
     if 'session_initialized' not in st.session_state:
         st.session_state.session_initialized = True
 
-# Check for stored session on app start
-def check_stored_session():
-    """Check if user has a stored session and restore it"""
-    # This will be handled by the browser storage script
-    pass
-
 init_session_state()
 
 # Performance optimization: Cache Google Sheets connection
@@ -244,12 +210,30 @@ def get_sheets_manager():
         st.error(f"Failed to connect to Google Sheets: {str(e)}")
         return None
 
+def _is_sheets_connection_error(error):
+    """True if error (or an exception it was raised from) is a Sheets API or transport failure"""
+    # SheetsManager re-raises most failures as plain Exceptions, so walk the chain
+    while error is not None:
+        if isinstance(error, (gspread.exceptions.APIError, requests.exceptions.RequestException, google.auth.exceptions.TransportError)):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+@st.cache_data(max_entries=4, ttl=1800, show_spinner=False)
+def prepare_team_dataframe(records):
+    """Build the team DataFrame and run the dtype optimization once per data load"""
+    df = optimize_dataframe(pd.DataFrame(records))
+    
+    # Lowercased search columns, built once here instead of on every search keystroke
+    for col in ('name', 'username'):
+        if col in df.columns:
+            df[f'_{col}_lower'] = df[col].astype(str).str.lower()
+    return df
+
 def login_page():
     """Display login page with background logo"""
     
     # Use base64 encoded background image approach
-    import base64
-    
     try:
         with open("msc_logo.png", "rb") as img_file:
             img_data = base64.b64encode(img_file.read()).decode()
@@ -322,29 +306,27 @@ def login_page():
         
         if submit_button:
             if authenticate_user(username, password):
-                st.session_state.logged_in = True
-                st.session_state.username = username
-                st.session_state.login_time = time.time()
+                # The token is opaque - the server-side session record maps it back to the username
+                session_token, expires_at = create_session(username)
+                _start_browser_session(username, session_token, expires_at)
                 
-                # Always use localStorage for persistent sessions
-                session_token = generate_session_token(username)
-                st.components.v1.html(f"""
-                <script>
-                localStorage.setItem('msc_drivr_logged_in', 'true');
-                localStorage.setItem('msc_drivr_username', '{username}');
-                localStorage.setItem('msc_drivr_session_token', '{session_token}');
-                localStorage.setItem('msc_drivr_login_time', '{int(time.time())}');
-                sessionStorage.setItem('msc_drivr_logged_in', 'true');
-                sessionStorage.setItem('msc_drivr_username', '{username}');
-                </script>
-                """, height=0)
-                
-                st.success("Login successful!")
+                # Straight to the app - anything rendered in this run is discarded by the rerun
                 st.rerun()
             else:
                 st.error("Invalid username or password")
 
 
+def _set_page(page):
+    """Navigation callback - runs before the rerun, so the click needs no second st.rerun()"""
+    st.session_state.current_page = page
+
+def _nav_item(label, page, key):
+    """Sidebar navigation entry - plain text for the current page, a button otherwise"""
+    if st.session_state.current_page == page:
+        st.write(f"→ {label}")
+    else:
+        st.button(label, key=key, on_click=_set_page, args=(page,))
+
 def main_app():
     """Main application interface with sidebar navigation"""
     # Configure sidebar
@@ -375,36 +357,16 @@ def main_app():
         st.write("**Navigation**")
         
         # Dashboard
-        if st.session_state.current_page == "Dashboard":
-            st.write("→ 🏠 Dashboard")
-        else:
-            if st.button("🏠 Dashboard", key="nav_dashboard"):
-                st.session_state.current_page = "Dashboard"
-                st.rerun()
+        _nav_item("🏠 Dashboard", "Dashboard", "nav_dashboard")
         
         # My Mileage
-        if st.session_state.current_page == "My Mileage":
-            st.write("→ 📊 My Mileage")
-        else:
-            if st.button("📊 My Mileage", key="nav_mileage"):
-                st.session_state.current_page = "My Mileage"
-                st.rerun()
+        _nav_item("📊 My Mileage", "My Mileage", "nav_mileage")
         
         # Safety Portal
-        if st.session_state.current_page == "Safety Portal":
-            st.write("→ 🛡️ Safety Portal")
-        else:
-            if st.button("🛡️ Safety Portal", key="nav_safety"):
-                st.session_state.current_page = "Safety Portal"
-                st.rerun()
+        _nav_item("🛡️ Safety Portal", "Safety Portal", "nav_safety")
         
         # Fitness Tracker
-        if st.session_state.current_page == "Fitness Tracker":
-            st.write("→ 💪 Fitness Tracker")
-        else:
-            if st.button("💪 Fitness Tracker", key="nav_fitness"):
-                st.session_state.current_page = "Fitness Tracker"
-                st.rerun()
+        _nav_item("💪 Fitness Tracker", "Fitness Tracker", "nav_fitness")
         
         # Admin features (if applicable)
         if sheets_manager and sheets_manager.is_admin_user(st.session_state.username):
@@ -412,20 +374,10 @@ def main_app():
             st.write("**Admin Features**")
             
             # Team Overview
-            if st.session_state.current_page == "Team Overview":
-                st.write("→ 👥 Team Overview")
-            else:
-                if st.button("👥 Team Overview", key="nav_team"):
-                    st.session_state.current_page = "Team Overview"
-                    st.rerun()
+            _nav_item("👥 Team Overview", "Team Overview", "nav_team")
             
             # Account Management
-            if st.session_state.current_page == "Account Management":
-                st.write("→ 👤 Account Management")
-            else:
-                if st.button("👤 Account Management", key="nav_accounts"):
-                    st.session_state.current_page = "Account Management"
-                    st.rerun()
+            _nav_item("👤 Account Management", "Account Management", "nav_accounts")
         
         # Commander features (if applicable)
         elif sheets_manager and sheets_manager.is_commander_user(st.session_state.username):
@@ -433,41 +385,32 @@ def main_app():
             st.write("**Commander Features**")
             
             # Team Overview for commanders
-            if st.session_state.current_page == "Team Overview":
-                st.write("→ 👥 Team Overview")
-            else:
-                if st.button("👥 Team Overview", key="nav_team_cmd"):
-                    st.session_state.current_page = "Team Overview"
-                    st.rerun()
+            _nav_item("👥 Team Overview", "Team Overview", "nav_team_cmd")
             
 
         
         st.markdown("---")
         
         # Change Password
-        if st.session_state.current_page == "Change Password":
-            st.write("→ 🔐 Change Password")
-        else:
-            if st.button("🔐 Change Password", key="nav_password"):
-                st.session_state.current_page = "Change Password"
-                st.rerun()
+        _nav_item("🔐 Change Password", "Change Password", "nav_password")
         
         # Logout button at bottom
         if st.button("🚪 Logout", key="logout_btn"):
-            # Clear browser storage on logout
-            st.components.v1.html("""
-            <script>
-            localStorage.removeItem('msc_drivr_logged_in');
-            localStorage.removeItem('msc_drivr_username');
-            localStorage.removeItem('msc_drivr_session_token');
-            localStorage.removeItem('msc_drivr_login_time');
-            sessionStorage.clear();
-            </script>
-            """, height=0)
+            # Write any queued mileage rows now rather than after the user has left
+            if sheets_manager:
+                sheets_manager.flush_mileage_logs()
+            
+            # Invalidate the server-side session
+            delete_session(st.session_state.get('session_token'))
             
             # Clear session state
             for key in list(st.session_state.keys()):
                 del st.session_state[key]
+            
+            # Clear browser storage on the next run - anything rendered before st.rerun() is discarded
+            st.session_state.pending_cookie_js = _LOGOUT_STORAGE_JS
+            # st.context.cookies still holds the old token for this websocket, so don't restore from it
+            st.session_state.restore_attempted = True
             st.rerun()
     
     # Initialize sheets manager with caching
@@ -504,19 +447,16 @@ def dashboard_landing_page(sheets_manager):
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        if st.button("🚗 My Mileage", key="goto_mileage", use_container_width=True):
-            st.session_state.current_page = "My Mileage"
-            st.rerun()
+        st.button("🚗 My Mileage", key="goto_mileage", use_container_width=True,
+                  on_click=_set_page, args=("My Mileage",))
     
     with col2:
-        if st.button("🛡️ Safety Portal", key="goto_safety", use_container_width=True):
-            st.session_state.current_page = "Safety Portal"
-            st.rerun()
+        st.button("🛡️ Safety Portal", key="goto_safety", use_container_width=True,
+                  on_click=_set_page, args=("Safety Portal",))
     
     with col3:
-        if st.button("💪 Fitness Tracker", key="goto_fitness", use_container_width=True):
-            st.session_state.current_page = "Fitness Tracker"
-            st.rerun()
+        st.button("💪 Fitness Tracker", key="goto_fitness", use_container_width=True,
+                  on_click=_set_page, args=("Fitness Tracker",))
 
 def fitness_tracker_page(sheets_manager):
     """Strength & Power fitness tracking system"""
@@ -630,7 +570,7 @@ def log_strength_workout(sheets_manager):
                 st.markdown("---")
             
             # Submit button
-            if st.form_submit_button("Log Workout", use_container_width=True):
+            if st.form_submit_button("Log Workout", use_container_width=True) and check_rate_limit():
 
                 
                 try:
@@ -733,7 +673,6 @@ def log_fitness_data(sheets_manager, session_number, exercise_data):
         full_name = user_qualifications.get('full_name', st.session_state.username)
         
         # Prepare single row with all exercises as columns
-        from datetime import datetime
         current_date = datetime.now().strftime("%Y-%m-%d")
         
         # Get header row and log in single row format
@@ -916,7 +855,6 @@ def view_fitness_progress(sheets_manager):
                             # Display weight progression chart (only for weighted exercises)
                             if not is_bodyweight and any(item['Weight (kg)'] > 0 for item in chart_data):
                                 st.markdown(f"**Weight Progression for {selected_exercise}**")
-                                import pandas as pd
                                 df = pd.DataFrame(chart_data)
                                 df = df[df['Weight (kg)'] > 0]  # Only show entries with weight data
                                 if not df.empty:
@@ -942,7 +880,6 @@ def view_fitness_progress(sheets_manager):
                                         })
                             
                             if performance_data:
-                                import pandas as pd
                                 df_performance = pd.DataFrame(performance_data)
                                 st.dataframe(df_performance, hide_index=True)
                             else:
@@ -1412,7 +1349,7 @@ def safety_infographic_tab(sheets_manager):
         
         submit_button = st.form_submit_button("📤 Submit Safety Infographic", type="primary")
         
-        if submit_button:
+        if submit_button and check_rate_limit():
             if not uploaded_file:
                 st.error("Please upload an image file.")
             else:
@@ -1543,7 +1480,7 @@ def safety_pointer_tab(sheets_manager):
         
         submit_button = st.form_submit_button("Submit Safety Pointer", type="primary")
         
-        if submit_button:
+        if submit_button and check_rate_limit():
             if not observation.strip():
                 st.error("Please enter your observation.")
             elif not reflection.strip():
@@ -1615,113 +1552,50 @@ def safety_pointer_tab(sheets_manager):
                 except Exception as e:
                     st.error(f"❌ Error submitting safety pointer: {str(e)}")
 
+def _dashboard_status_html(emoji, label, data):
+    """Build the dashboard currency card for one vehicle type from its tracker sheet record"""
+    if not data:
+        return (f'<div class="status-expiring"><h2>{emoji} {label} - ⚠️ NO DATA</h2>'
+                '<p>No mileage data found. Start logging to track your currency.</p></div>')
+    
+    status = str(data.get('Currency Maintained', 'N/A')).upper()
+    distance = data.get('Distance in Last 3 Months', 0.0)
+    
+    if status == 'YES':
+        return (f'<div class="status-current"><h2>{emoji} {label} - ✅ CURRENT</h2>'
+                f'<p><strong>{distance:.1f} KM</strong> driven in last 3 months (Min: 2.0 KM)</p>'
+                f'<p>Currency expires: <strong>{data.get("Lapsing Date", "N/A")}</strong></p></div>')
+    if status == 'NO':
+        return (f'<div class="status-expired"><h2>{emoji} {label} - ❌ NOT CURRENT</h2>'
+                f'<p><strong>{distance:.1f} KM</strong> driven in last 3 months (Min: 2.0 KM required)</p>'
+                '<p><strong>ACTION REQUIRED:</strong> Log mileage to maintain currency</p></div>')
+    return (f'<div class="status-expiring"><h2>{emoji} {label} - ⚠️ STATUS UNKNOWN</h2>'
+            '<p>Unable to determine currency status</p></div>')
+
 def dashboard_tab(sheets_manager):
     """Dashboard overview"""
     
     try:
         # Individual dashboard (for both admin and regular users)
-        # Get user qualifications
-        qualifications = sheets_manager.check_user_qualifications(st.session_state.username)
-        
-        # Get user's tracker data
-        tracker_data = sheets_manager.get_user_tracker_data(st.session_state.username)
+        # Qualifications, tracker data and mileage logs in one cached batchGet
+        qualifications, tracker_data, user_data = sheets_manager.get_currency_bundle(st.session_state.username)
         
         # Currency status display - most important information
         
         # Check qualifications and display currency status prominently
-        qualified_vehicles = []
-        if qualifications['terrex']:
-            qualified_vehicles.append('terrex')
-        if qualifications['belrex']:
-            qualified_vehicles.append('belrex')
+        qualified_vehicles = [vehicle for vehicle in _VEHICLE_META if qualifications[vehicle]]
         
         if len(qualified_vehicles) == 0:
             st.error("❌ You are not qualified for any vehicle type.")
             return
         
-        # Show currency status for each qualified vehicle with prominent styling
-        for vehicle in qualified_vehicles:
-            if vehicle == 'terrex' and tracker_data['terrex']:
-                terrex_data = tracker_data['terrex']
-                currency_status = terrex_data.get('Currency Maintained', 'N/A')
-                distance = float(terrex_data.get('Distance in Last 3 Months', 0) or 0)
-                expiry_date = terrex_data.get('Lapsing Date', 'N/A')
-                
-                # Large, prominent status display
-                if currency_status.upper() == 'YES':
-                    st.markdown("""
-                    <div class="status-current">
-                        <h2>🚛 TERREX - ✅ CURRENT</h2>
-                        <p><strong>{:.1f} KM</strong> driven in last 3 months (Min: 2.0 KM)</p>
-                        <p>Currency expires: <strong>{}</strong></p>
-                    </div>
-                    """.format(distance, expiry_date), unsafe_allow_html=True)
-                elif currency_status.upper() == 'NO':
-                    st.markdown("""
-                    <div class="status-expired">
-                        <h2>🚛 TERREX - ❌ NOT CURRENT</h2>
-                        <p><strong>{:.1f} KM</strong> driven in last 3 months (Min: 2.0 KM required)</p>
-                        <p><strong>ACTION REQUIRED:</strong> Log mileage to maintain currency</p>
-                    </div>
-                    """.format(distance), unsafe_allow_html=True)
-                else:
-                    st.markdown("""
-                    <div class="status-expiring">
-                        <h2>🚛 TERREX - ⚠️ STATUS UNKNOWN</h2>
-                        <p>Unable to determine currency status</p>
-                    </div>
-                    """, unsafe_allow_html=True)
-            
-            elif vehicle == 'belrex' and tracker_data['belrex']:
-                belrex_data = tracker_data['belrex']
-                currency_status = belrex_data.get('Currency Maintained', 'N/A')
-                distance = float(belrex_data.get('Distance in Last 3 Months', 0) or 0)
-                expiry_date = belrex_data.get('Lapsing Date', 'N/A')
-                
-                # Large, prominent status display
-                if currency_status.upper() == 'YES':
-                    st.markdown("""
-                    <div class="status-current">
-                        <h2>🚗 BELREX - ✅ CURRENT</h2>
-                        <p><strong>{:.1f} KM</strong> driven in last 3 months (Min: 2.0 KM)</p>
-                        <p>Currency expires: <strong>{}</strong></p>
-                    </div>
-                    """.format(distance, expiry_date), unsafe_allow_html=True)
-                elif currency_status.upper() == 'NO':
-                    st.markdown("""
-                    <div class="status-expired">
-                        <h2>🚗 BELREX - ❌ NOT CURRENT</h2>
-                        <p><strong>{:.1f} KM</strong> driven in last 3 months (Min: 2.0 KM required)</p>
-                        <p><strong>ACTION REQUIRED:</strong> Log mileage to maintain currency</p>
-                    </div>
-                    """.format(distance), unsafe_allow_html=True)
-                else:
-                    st.markdown("""
-                    <div class="status-expiring">
-                        <h2>🚗 BELREX - ⚠️ STATUS UNKNOWN</h2>
-                        <p>Unable to determine currency status</p>
-                    </div>
-                    """, unsafe_allow_html=True)
-            
-            elif vehicle == 'terrex':
-                st.markdown("""
-                <div class="status-expiring">
-                    <h2>🚛 TERREX - ⚠️ NO DATA</h2>
-                    <p>No mileage data found. Start logging to track your currency.</p>
-                </div>
-                """, unsafe_allow_html=True)
-            
-            elif vehicle == 'belrex':
-                st.markdown("""
-                <div class="status-expiring">
-                    <h2>🚗 BELREX - ⚠️ NO DATA</h2>
-                    <p>No mileage data found. Start logging to track your currency.</p>
-                </div>
-                """, unsafe_allow_html=True)
-        
+        # One markdown element for all qualified vehicles instead of one per vehicle
+        st.markdown("\n".join(
+            _dashboard_status_html(*_VEHICLE_META[vehicle], tracker_data[vehicle])
+            for vehicle in qualified_vehicles
+        ), unsafe_allow_html=True)
         
         # Show recent entries only if data exists and user wants to see it
-        user_data = sheets_manager.get_user_data(st.session_state.username)
         if not user_data.empty:
             with st.expander("📋 Recent Mileage Logs (Last 5)", expanded=False):
                 recent_data = user_data.tail(5)[['Date_of_Drive', 'Vehicle_Type', 'Vehicle_No_MID', 'Distance_Driven_KM']].copy()
@@ -1736,142 +1610,15 @@ def admin_team_dashboard(sheets_manager):
     """Revamped admin team overview dashboard"""
     
     # Add CSS styles for dashboard
-    st.markdown("""
-    <style>
-        /* Enhanced Metric Cards - All same height */
-        .metric-card-current, .metric-card-expired, .metric-card-expiring, .metric-card-vehicles {
-            padding: 15px 10px;
-            border-radius: 12px;
-            text-align: center;
-            margin: 0;
-            box-shadow: 0 4px 12px rgba(0,0,0,0.15);
-            height: 160px;
-            display: flex;
-            flex-direction: column;
-            justify-content: center;
-            align-items: center;
-            overflow: visible;
-            box-sizing: border-box;
-            transition: transform 0.2s ease, box-shadow 0.2s ease;
-            position: relative;
-            width: 100%;
-        }
-        
-        /* Hover effects for cards */
-        .metric-card-current:hover, .metric-card-expired:hover, .metric-card-expiring:hover, .metric-card-vehicles:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 6px 16px rgba(0,0,0,0.2);
-        }
-        
-        /* Optimized text sizing for metric cards to prevent cutoff */
-        .metric-card-current h2, .metric-card-expired h2, .metric-card-expiring h2, .metric-card-vehicles h2 {
-            margin: 5px 0;
-            font-size: clamp(1.4rem, 3vw, 1.8rem);
-            line-height: 1.1;
-            font-weight: 700;
-            text-shadow: 0 1px 2px rgba(0,0,0,0.1);
-        }
-        
-        .metric-card-current p, .metric-card-expired p, .metric-card-expiring p, .metric-card-vehicles p {
-            margin: 4px 0;
-            font-size: clamp(0.85rem, 2vw, 1rem);
-            line-height: 1.2;
-            font-weight: 600;
-        }
-        
-        .metric-card-current small, .metric-card-expired small, .metric-card-expiring small, .metric-card-vehicles small {
-            margin: 3px 0;
-            font-size: clamp(0.7rem, 1.5vw, 0.8rem);
-            line-height: 1.1;
-            opacity: 0.8;
-        }
-        
-        /* Container for metric cards grid - ensures equal heights */
-        .metrics-container {
-            display: grid;
-            grid-template-columns: repeat(4, 1fr);
-            grid-template-rows: 1fr;
-            gap: 15px;
-            margin: 20px 0;
-            width: 100%;
-            align-items: stretch;
-        }
-        
-        /* Individual metric card wrapper - ensures cards fill full height */
-        .metric-wrapper {
-            width: 100%;
-            height: 100%;
-            box-sizing: border-box;
-            display: flex;
-            align-items: stretch;
-        }
-        
-        .metric-wrapper > div {
-            flex: 1;
-        }
-        
-        /* Responsive grid for smaller screens */
-        @media (max-width: 768px) {
-            .metrics-container {
-                grid-template-columns: repeat(2, 1fr);
-                gap: 10px;
-            }
-        }
-        
-        @media (max-width: 480px) {
-            .metrics-container {
-                grid-template-columns: 1fr;
-                gap: 8px;
-            }
-        }
-        
-        .metric-card-current {
-            background: linear-gradient(135deg, #d4edda, #c3e6cb);
-            color: #155724;
-            border-left: 5px solid #28a745;
-        }
-        .metric-card-expired {
-            background: linear-gradient(135deg, #f8d7da, #f1b0b7);
-            color: #721c24;
-            border-left: 5px solid #dc3545;
-        }
-        .metric-card-expiring {
-            background: linear-gradient(135deg, #fff3cd, #ffeaa7);
-            color: #856404;
-            border-left: 5px solid #ffc107;
-        }
-        .metric-card-vehicles {
-            background: linear-gradient(135deg, #e2e3e5, #d1d3d4);
-            color: #383d41;
-            border-left: 5px solid #6c757d;
-        }
-        
-        /* Action Items */
-        .action-item-critical {
-            background-color: #f8d7da;
-            color: #721c24;
-            padding: 12px;
-            border-radius: 8px;
-            margin: 8px 0;
-            border-left: 4px solid #dc3545;
-        }
-        .action-item-warning {
-            background-color: #fff3cd;
-            color: #856404;
-            padding: 12px;
-            border-radius: 8px;
-            margin: 8px 0;
-            border-left: 4px solid #ffc107;
-        }
-        
-
-    </style>
-    """, unsafe_allow_html=True)
+    inject_css("team_dashboard.css")
     
     # Header with refresh button
     col1, col2 = st.columns([1, 4])
     with col1:
         if st.button("🔄 Refresh", help="Get latest data"):
+            # Write queued mileage rows while this manager is still the cached one
+            sheets_manager.flush_mileage_logs()
+            
             # Clear all relevant caches for immediate updates
             clear_session_cache()
             st.cache_data.clear()
@@ -1896,40 +1643,50 @@ def admin_team_dashboard(sheets_manager):
 def mileage_team_overview(sheets_manager):
     """Team overview for mileage/vehicle currency"""
     try:
-        # Get all personnel status with session caching for faster loading
+        # Fully processed frame cached in the session - the key includes the manager's data version,
+        # which each successful mileage flush bumps, so reruns skip the DataFrame build and dtype coercion
         @session_cache(ttl=600)  # 10 minute session cache
-        def get_cached_personnel_status():
-            return sheets_manager.get_all_personnel_status()
-        
-        all_personnel = get_cached_personnel_status()
-        
-        if not all_personnel:
+        def get_cached_personnel_frame(manager_id, data_version):
+            all_personnel = sheets_manager.get_all_personnel_status()
+            if not all_personnel:
+                return None
+            
+            df = prepare_team_dataframe(all_personnel)
+            # Status masks built once - filters index with these instead of re-comparing strings
+            status_upper = df['currency_status'].astype(str).str.upper()
+            df['_is_current'] = status_upper.eq('YES')
+            df['_not_current'] = status_upper.eq('NO')
+            if 'days_to_expiry' in df.columns:
+                df['days_to_expiry_num'] = pd.to_numeric(df['days_to_expiry'], errors='coerce')
+                df['_expiring_soon'] = df['_is_current'] & (df['days_to_expiry_num'] <= 14)
+            return df
+        
+        # A rebuilt manager restarts its version at 0, so its identity is part of the key too
+        df = get_cached_personnel_frame(id(sheets_manager), sheets_manager.data_version)
+        
+        if df is None:
             st.warning("No personnel data found.")
             return
         
-        # Convert to DataFrame for easier analysis with optimization
-        import pandas as pd
-        df = pd.DataFrame(all_personnel)
-        df = optimize_dataframe(df)  # Optimize memory usage
-        
         # Key Metrics Section
         st.subheader("📊 Overall Status")
         
         total_personnel = len(df)
-        current_count = len(df[df['currency_status'].str.upper() == 'YES'])
-        not_current_count = len(df[df['currency_status'].str.upper() == 'NO'])
+        current_count = int(df['_is_current'].sum())
+        not_current_count = int(df['_not_current'].sum())
         
-        try:
-            df['days_to_expiry_num'] = pd.to_numeric(df['days_to_expiry'], errors='coerce')
-            expiring_soon = len(df[(df['currency_status'].str.upper() == 'YES') & (df['days_to_expiry_num'] <= 14)])
-        except:
+        has_expiry = '_expiring_soon' in df.columns
+        
+        if has_expiry:
+            expiring_soon = int(df['_expiring_soon'].sum())
+        else:
             expiring_soon = 0
         
         # Vehicle breakdown
         terrex_personnel = df[df['vehicle_type'] == 'Terrex']
         belrex_personnel = df[df['vehicle_type'] == 'Belrex']
-        terrex_current = len(terrex_personnel[terrex_personnel['currency_status'].str.upper() == 'YES'])
-        belrex_current = len(belrex_personnel[belrex_personnel['currency_status'].str.upper() == 'YES'])
+        terrex_current = int(terrex_personnel['_is_current'].sum())
+        belrex_current = int(belrex_personnel['_is_current'].sum())
         
         # Display metrics in improved grid layout
         st.markdown("""
@@ -1995,15 +1752,14 @@ def mileage_team_overview(sheets_manager):
         
         with col1:
             st.markdown("#### Immediate Action Required")
-            not_current = df[df['currency_status'].str.upper() == 'NO']
+            not_current = df[df['_not_current']]
             if len(not_current) > 0:
-                for _, person in not_current.head(8).iterrows():  # Limit for better display
-                    st.markdown(f"""
-                    <div class="action-item-critical">
-                        <strong>{person['rank']} {person['name']}</strong><br>
-                        <small>{person['vehicle_type']} • {person['distance_3_months']:.1f} KM (3mo)</small>
-                    </div>
-                    """, unsafe_allow_html=True)
+                top = not_current.head(8)  # Limit for better display
+                cards = [
+                    format_critical_card(rank=rank, name=name, vehicle=vehicle, km=km)
+                    for rank, name, vehicle, km in zip(top['rank'], top['name'], top['vehicle_type'], top['distance_3_months'])
+                ]
+                st.markdown(''.join(cards), unsafe_allow_html=True)
                 if len(not_current) > 8:
                     st.info(f"... and {len(not_current) - 8} more personnel need drives")
             else:
@@ -2011,22 +1767,21 @@ def mileage_team_overview(sheets_manager):
         
         with col2:
             st.markdown("#### Expiring Within 14 Days")
-            try:
-                expiring = df[(df['currency_status'].str.upper() == 'YES') & (df['days_to_expiry_num'] <= 14)]
+            if has_expiry:
+                expiring = df[df['_expiring_soon']]
                 if len(expiring) > 0:
-                    for _, person in expiring.head(8).iterrows():
-                        days_left = int(person['days_to_expiry_num']) if pd.notna(person['days_to_expiry_num']) else 0
-                        st.markdown(f"""
-                        <div class="action-item-warning">
-                            <strong>{person['rank']} {person['name']}</strong><br>
-                            <small>{person['vehicle_type']} • Expires in {days_left} days</small>
-                        </div>
-                        """, unsafe_allow_html=True)
+                    top = expiring.head(8)
+                    days_left = top['days_to_expiry_num'].fillna(0).astype(int)
+                    cards = [
+                        format_expiring_card(rank=rank, name=name, vehicle=vehicle, days=days)
+                        for rank, name, vehicle, days in zip(top['rank'], top['name'], top['vehicle_type'], days_left)
+                    ]
+                    st.markdown(''.join(cards), unsafe_allow_html=True)
                     if len(expiring) > 8:
                         st.info(f"... and {len(expiring) - 8} more expiring soon")
                 else:
                     st.success("No immediate expirations")
-            except:
+            else:
                 st.info("No expiration data available")
         
         st.markdown("---")
@@ -2034,124 +1789,134 @@ def mileage_team_overview(sheets_manager):
         # Platoon Status Section
         st.subheader("🏢 Platoon Overview")
         
-        # Group by platoon
-        platoon_groups = df.groupby('platoon').agg({
-            'currency_status': lambda x: (x.str.upper() == 'YES').sum(),
-            'username': 'count'
-        }).reset_index()
-        platoon_groups.columns = ['Platoon', 'Current', 'Total']
-        platoon_groups['Current_Rate'] = (platoon_groups['Current'] / platoon_groups['Total'] * 100).round(1)
+        # Group once - the per-platoon aggregates and member frames share one group index
+        groups = df.groupby('platoon', observed=True)
+        platoon_stats = groups.agg(
+            Current=('_is_current', 'sum'),
+            Not_Current=('_not_current', 'sum'),
+            Total=('username', 'count'),
+            Avg_Distance=('distance_3_months', 'mean')
+        )
+        platoon_stats['Current_Rate'] = (platoon_stats['Current'] / platoon_stats['Total'] * 100).round(1)
+        platoon_stats = platoon_stats.to_dict('index')
+        
+        # Display columns selected and renamed once - each expander just takes its rows
+        roster = df[['rank', 'name', 'vehicle_type', 'currency_status', 'distance_3_months', 'days_to_expiry']].set_axis(
+            ['Rank', 'Name', 'Vehicle', 'Status', '3-Month KM', 'Days to Expiry'], axis=1
+        )
         
         # Display each platoon as an expandable section
-        for _, platoon in platoon_groups.iterrows():
+        for platoon_name, platoon_personnel in groups:
+            platoon = platoon_stats[platoon_name]
             current_rate = platoon['Current_Rate']
             status_emoji = "✅" if current_rate >= 80 else ("⚠️" if current_rate >= 60 else "❌")
             status_text = "Excellent" if current_rate >= 80 else ("Good" if current_rate >= 60 else "Needs Attention")
             
             # Create expandable section for each platoon
-            with st.expander(f"{status_emoji} **{platoon['Platoon']}** - {platoon['Current']}/{platoon['Total']} Current ({current_rate:.1f}%) - {status_text}", expanded=False):
-                
-                # Get personnel for this platoon
-                platoon_personnel = df[df['platoon'] == platoon['Platoon']]
+            with st.expander(f"{status_emoji} **{platoon_name}** - {platoon['Current']}/{platoon['Total']} Current ({current_rate:.1f}%) - {status_text}", expanded=False):
                 
                 # Quick stats row
                 col1, col2, col3, col4 = st.columns(4)
                 with col1:
                     st.metric("Total Personnel", len(platoon_personnel))
                 with col2:
-                    current_in_platoon = len(platoon_personnel[platoon_personnel['currency_status'].str.upper() == 'YES'])
-                    st.metric("Current", current_in_platoon, delta=f"{current_rate:.1f}%")
+                    st.metric("Current", platoon['Current'], delta=f"{current_rate:.1f}%")
                 with col3:
-                    not_current_in_platoon = len(platoon_personnel[platoon_personnel['currency_status'].str.upper() == 'NO'])
-                    st.metric("Not Current", not_current_in_platoon)
+                    st.metric("Not Current", platoon['Not_Current'])
                 with col4:
-                    avg_distance = platoon_personnel['distance_3_months'].mean()
-                    st.metric("Avg Distance", f"{avg_distance:.1f} KM")
+                    st.metric("Avg Distance", f"{platoon['Avg_Distance']:.1f} KM")
                 
                 # Critical personnel in this platoon
-                platoon_not_current = platoon_personnel[platoon_personnel['currency_status'].str.upper() == 'NO']
+                platoon_not_current = platoon_personnel[platoon_personnel['_not_current']]
                 if len(platoon_not_current) > 0:
                     st.markdown("**🚨 Personnel Needing Immediate Drives:**")
-                    for _, person in platoon_not_current.iterrows():
-                        st.markdown(f"""
-                        <div class="action-item-critical" style="margin: 5px 0;">
-                            <strong>{person['rank']} {person['name']}</strong> ({person['vehicle_type']}) - {person['distance_3_months']:.1f} KM in last 3 months
-                        </div>
-                        """, unsafe_allow_html=True)
+                    cards = [
+                        format_platoon_critical_card(rank=rank, name=name, vehicle=vehicle, km=km)
+                        for rank, name, vehicle, km in zip(
+                            platoon_not_current['rank'], platoon_not_current['name'],
+                            platoon_not_current['vehicle_type'], platoon_not_current['distance_3_months']
+                        )
+                    ]
+                    st.markdown(''.join(cards), unsafe_allow_html=True)
                 else:
                     st.success("🎉 All personnel in this platoon are current!")
                 
                 # Expiring personnel in this platoon
-                try:
-                    platoon_expiring = platoon_personnel[(platoon_personnel['currency_status'].str.upper() == 'YES') & (platoon_personnel['days_to_expiry_num'] <= 14)]
+                if has_expiry:
+                    platoon_expiring = platoon_personnel[platoon_personnel['_expiring_soon']]
                     if len(platoon_expiring) > 0:
                         st.markdown("**⏰ Personnel Expiring Within 14 Days:**")
-                        for _, person in platoon_expiring.iterrows():
-                            days_left = int(person['days_to_expiry_num']) if pd.notna(person['days_to_expiry_num']) else 0
-                            st.markdown(f"""
-                            <div class="action-item-warning" style="margin: 5px 0;">
-                                <strong>{person['rank']} {person['name']}</strong> ({person['vehicle_type']}) - Expires in {days_left} days
-                            </div>
-                            """, unsafe_allow_html=True)
-                except:
-                    pass
+                        days_left = platoon_expiring['days_to_expiry_num'].fillna(0).astype(int)
+                        cards = [
+                            format_platoon_expiring_card(rank=rank, name=name, vehicle=vehicle, days=days)
+                            for rank, name, vehicle, days in zip(
+                                platoon_expiring['rank'], platoon_expiring['name'],
+                                platoon_expiring['vehicle_type'], days_left
+                            )
+                        ]
+                        st.markdown(''.join(cards), unsafe_allow_html=True)
                 
                 # Full personnel table for this platoon
                 st.markdown("**📋 Complete Platoon Roster:**")
-                display_cols = ['rank', 'name', 'vehicle_type', 'currency_status', 'distance_3_months', 'days_to_expiry']
-                display_df = platoon_personnel[display_cols].copy()
-                display_df.columns = ['Rank', 'Name', 'Vehicle', 'Status', '3-Month KM', 'Days to Expiry']
-                
-                # Ensure 'Days to Expiry' column is treated as string to avoid Arrow serialization errors
-                display_df['Days to Expiry'] = display_df['Days to Expiry'].astype(str)
-                
-                st.dataframe(display_df, use_container_width=True, height=200)
+                st.dataframe(roster.loc[platoon_personnel.index], use_container_width=True, height=200)
         
         # Personnel Search Section
+        personnel_search_section(df)
+            
+    except Exception as e:
+        st.error(f"Error loading team dashboard: {str(e)}")
+
+@st.fragment
+def personnel_search_section(df):
+    """Personnel search table - fragment, so filter changes only rerun this section"""
+    try:
         st.subheader("🔍 Personnel Search")
-        
-        col1, col2, col3 = st.columns([2, 1, 1])
-        with col1:
-            search_term = st.text_input("Search by name or username:", placeholder="Type name to search...")
-        with col2:
-            status_filter = st.selectbox("Status:", ["All", "Current", "Not Current"])
-        with col3:
-            vehicle_filter = st.selectbox("Vehicle:", ["All", "Terrex", "Belrex"])
-        
-        # Apply filters
-        filtered_df = df.copy()
+
+        # Filters apply together on submit (or Enter) - one fragment rerun instead of one per widget
+        with st.form("personnel_filters", border=False):
+            col1, col2, col3 = st.columns([2, 1, 1])
+            with col1:
+                search_term = st.text_input("Search by name or username:", placeholder="Type name to search...")
+            with col2:
+                status_filter = st.selectbox("Status:", ["All", "Current", "Not Current"])
+            with col3:
+                vehicle_filter = st.selectbox("Vehicle:", ["All", "Terrex", "Belrex"])
+            st.form_submit_button("Apply")
+
+        # Apply filters as one combined mask and slice the frame once
+        mask = np.ones(len(df), dtype=bool)
         if search_term:
-            filtered_df = filtered_df[
-                filtered_df['name'].str.contains(search_term, case=False, na=False) |
-                filtered_df['username'].str.contains(search_term, case=False, na=False)
-            ]
-        
+            term = search_term.lower()
+            mask &= (
+                df['_name_lower'].str.contains(term, regex=False, na=False) |
+                df['_username_lower'].str.contains(term, regex=False, na=False)
+            ).to_numpy()
+
         if status_filter == "Current":
-            filtered_df = filtered_df[filtered_df['currency_status'].str.upper() == 'YES']
+            mask &= df['_is_current'].to_numpy()
         elif status_filter == "Not Current":
-            filtered_df = filtered_df[filtered_df['currency_status'].str.upper() == 'NO']
-            
+            mask &= df['_not_current'].to_numpy()
+
         if vehicle_filter != "All":
-            filtered_df = filtered_df[filtered_df['vehicle_type'] == vehicle_filter]
-        
+            mask &= (df['vehicle_type'] == vehicle_filter).to_numpy()
+
         # Display filtered results
-        if len(filtered_df) > 0:
-            st.markdown(f"**Found {len(filtered_df)} personnel**")
-            
+        if mask.any():
+            st.markdown(f"**Found {int(mask.sum())} personnel**")
+
             display_cols = ['rank', 'name', 'platoon', 'vehicle_type', 'currency_status', 'distance_3_months', 'days_to_expiry']
-            table_df = filtered_df[display_cols].copy()
-            table_df.columns = ['Rank', 'Name', 'Platoon', 'Vehicle', 'Status', '3-Month KM', 'Days to Expiry']
-            
+            table_df = df.loc[mask, display_cols].set_axis(
+                ['Rank', 'Name', 'Platoon', 'Vehicle', 'Status', '3-Month KM', 'Days to Expiry'], axis=1
+            )
+
             # Clean up data types for display
-            table_df['Days to Expiry'] = table_df['Days to Expiry'].astype(str)
             table_df['3-Month KM'] = pd.to_numeric(table_df['3-Month KM'], errors='coerce').fillna(0).round(1)
-            
-            st.dataframe(table_df, use_container_width=True, height=400)
+
+            display_dataframe_quickly(table_df, key="pers_slider", use_container_width=True, height=400)
         else:
             st.info("No personnel found matching the current filters.")
-            
     except Exception as e:
-        st.error(f"Error loading team dashboard: {str(e)}")
+        st.error(f"Error loading personnel search: {str(e)}")
 
 def fitness_team_overview(sheets_manager):
     """Team overview for fitness progress"""
@@ -2169,17 +1934,21 @@ def fitness_team_overview(sheets_manager):
             st.warning("No S&P programme data found.")
             return
         
-        # Convert to DataFrame for analysis
-        import pandas as pd
-        df = pd.DataFrame(fitness_data)
-        df = optimize_dataframe(df)
+        # Convert to DataFrame for analysis (cached per data load)
+        df = prepare_team_dataframe(fitness_data)
+        
+        # Optional columns - checked once instead of on every branch
+        caps = {col: col in df.columns for col in (
+            'progress_trend', 'avg_weight_increase', 'personal_records',
+            'max_weight_lifted', 'weight_increase', 'recent_prs', 'platoon'
+        )}
         
         # S&P Progress Overview Section
         st.subheader("📊 S&P Progress Overview")
         
         total_personnel = len(df)
         active_personnel = len(df[df['recent_workouts'] > 0])
-        improving_personnel = len(df[df['progress_trend'] == 'improving']) if 'progress_trend' in df.columns else 0
+        improving_personnel = len(df[df['progress_trend'] == 'improving']) if caps['progress_trend'] else 0
         avg_sessions = df['recent_workouts'].mean() if total_personnel > 0 else 0
         
         # Display progress metrics in improved grid layout
@@ -2202,7 +1971,7 @@ def fitness_team_overview(sheets_manager):
             """, unsafe_allow_html=True)
         
         with col2:
-            if 'progress_trend' in df.columns:
+            if caps['progress_trend']:
                 improving_rate = (improving_personnel/total_personnel*100) if total_personnel > 0 else 0
                 st.markdown(f"""
                 <div class="metric-wrapper">
@@ -2226,7 +1995,7 @@ def fitness_team_overview(sheets_manager):
                 """, unsafe_allow_html=True)
         
         with col3:
-            if 'avg_weight_increase' in df.columns:
+            if caps['avg_weight_increase']:
                 avg_weight_increase = df['avg_weight_increase'].mean()
                 st.markdown(f"""
                 <div class="metric-wrapper">
@@ -2249,7 +2018,7 @@ def fitness_team_overview(sheets_manager):
                 """, unsafe_allow_html=True)
         
         with col4:
-            if 'personal_records' in df.columns:
+            if caps['personal_records']:
                 total_prs = df['personal_records'].sum()
                 st.markdown(f"""
                 <div class="metric-wrapper">
@@ -2283,50 +2052,43 @@ def fitness_team_overview(sheets_manager):
         
         with col1:
             st.markdown("#### Strength Gainers")
-            if 'max_weight_lifted' in df.columns:
-                strength_gainers = df.nlargest(8, 'max_weight_lifted')
+            if caps['max_weight_lifted']:
+                strength_gainers = top_k_rows(df, 'max_weight_lifted', 8)
                 if len(strength_gainers) > 0:
-                    for _, person in strength_gainers.iterrows():
-                        if person['max_weight_lifted'] > 0:
-                            progress_indicator = ""
-                            if 'weight_increase' in df.columns and person['weight_increase'] > 0:
-                                progress_indicator = f" (+{person['weight_increase']:.1f}kg)"
-                            st.markdown(f"""
-                            <div class="action-item-warning" style="background-color: #d4edda; color: #155724; border-left: 4px solid #28a745;">
-                                <strong>{person['rank']} {person['name']}</strong><br>
-                                <small>Max: {person['max_weight_lifted']:.1f}kg{progress_indicator}</small>
-                            </div>
-                            """, unsafe_allow_html=True)
+                    gainers = strength_gainers[strength_gainers['max_weight_lifted'] > 0]
+                    increases = gainers['weight_increase'] if caps['weight_increase'] else [0] * len(gainers)
+                    cards = [
+                        format_strength_card(rank=rank, name=name, weight=weight,
+                                             progress=f" (+{increase:.1f}kg)" if increase > 0 else "")
+                        for rank, name, weight, increase in zip(gainers['rank'], gainers['name'], gainers['max_weight_lifted'], increases)
+                    ]
+                    st.markdown(''.join(cards), unsafe_allow_html=True)
                 else:
                     st.info("No strength data available")
             else:
                 # Fallback to session count
-                top_performers = df.nlargest(8, 'recent_workouts')
+                top_performers = top_k_rows(df, 'recent_workouts', 8)
                 if len(top_performers) > 0:
-                    for _, person in top_performers.iterrows():
-                        if person['recent_workouts'] > 0:
-                            st.markdown(f"""
-                            <div class="action-item-warning" style="background-color: #d1ecf1; color: #0c5460; border-left: 4px solid #17a2b8;">
-                                <strong>{person['rank']} {person['name']}</strong><br>
-                                <small>{person['recent_workouts']} sessions completed</small>
-                            </div>
-                            """, unsafe_allow_html=True)
+                    active = top_performers[top_performers['recent_workouts'] > 0]
+                    cards = [
+                        format_sessions_card(rank=rank, name=name, sessions=sessions)
+                        for rank, name, sessions in zip(active['rank'], active['name'], active['recent_workouts'])
+                    ]
+                    st.markdown(''.join(cards), unsafe_allow_html=True)
                 else:
                     st.info("No session data available")
         
         with col2:
             st.markdown("#### Personal Records")
-            if 'recent_prs' in df.columns:
-                pr_leaders = df.nlargest(8, 'recent_prs')
+            if caps['recent_prs']:
+                pr_leaders = top_k_rows(df, 'recent_prs', 8)
                 if len(pr_leaders) > 0:
-                    for _, person in pr_leaders.iterrows():
-                        if person['recent_prs'] > 0:
-                            st.markdown(f"""
-                            <div class="action-item-warning" style="background-color: #fff3cd; color: #856404; border-left: 4px solid #ffc107;">
-                                <strong>{person['rank']} {person['name']}</strong><br>
-                                <small>{person['recent_prs']} PRs this month</small>
-                            </div>
-                            """, unsafe_allow_html=True)
+                    leaders = pr_leaders[pr_leaders['recent_prs'] > 0]
+                    cards = [
+                        format_pr_card(rank=rank, name=name, prs=prs)
+                        for rank, name, prs in zip(leaders['rank'], leaders['name'], leaders['recent_prs'])
+                    ]
+                    st.markdown(''.join(cards), unsafe_allow_html=True)
                 else:
                     st.info("No recent personal records")
             else:
@@ -2334,13 +2096,9 @@ def fitness_team_overview(sheets_manager):
                 st.markdown("#### Needs Support")
                 inactive = df[df['recent_workouts'] == 0]
                 if len(inactive) > 0:
-                    for _, person in inactive.head(8).iterrows():
-                        st.markdown(f"""
-                        <div class="action-item-critical">
-                            <strong>{person['rank']} {person['name']}</strong><br>
-                            <small>No recent training sessions</small>
-                        </div>
-                        """, unsafe_allow_html=True)
+                    top = inactive.head(8)
+                    cards = [format_support_card(rank=rank, name=name) for rank, name in zip(top['rank'], top['name'])]
+                    st.markdown(''.join(cards), unsafe_allow_html=True)
                     if len(inactive) > 8:
                         st.info(f"... and {len(inactive) - 8} more need support")
                 else:
@@ -2352,22 +2110,22 @@ def fitness_team_overview(sheets_manager):
         st.subheader("🏢 Platoon Progress Breakdown")
         
         # Group by platoon
-        if 'platoon' in df.columns:
+        if caps['platoon']:
             agg_dict = {
                 'recent_workouts': ['count', 'sum', 'mean'],
                 'username': 'count'
             }
-            if 'max_weight_lifted' in df.columns:
+            if caps['max_weight_lifted']:
                 agg_dict['max_weight_lifted'] = 'mean'
-            if 'recent_prs' in df.columns:
+            if caps['recent_prs']:
                 agg_dict['recent_prs'] = 'sum'
                 
             platoon_groups = df.groupby('platoon').agg(agg_dict).reset_index()
             
             # Flatten column names
             platoon_groups.columns = ['Platoon', 'Active_Count', 'Total_Sessions', 'Avg_Sessions', 'Total_Personnel'] + \
-                                   (['Avg_Max_Weight'] if 'max_weight_lifted' in df.columns else []) + \
-                                   (['Total_PRs'] if 'recent_prs' in df.columns else [])
+                                   (['Avg_Max_Weight'] if caps['max_weight_lifted'] else []) + \
+                                   (['Total_PRs'] if caps['recent_prs'] else [])
             
             # Display each platoon
             for _, platoon in platoon_groups.iterrows():
@@ -2414,9 +2172,9 @@ def fitness_team_overview(sheets_manager):
                     # Personnel table for this platoon with progress focus
                     st.markdown("**📋 Platoon Progress Status:**")
                     display_cols = ['rank', 'name', 'recent_workouts', 'last_workout_date']
-                    if 'max_weight_lifted' in platoon_personnel.columns:
+                    if caps['max_weight_lifted']:
                         display_cols.append('max_weight_lifted')
-                    if 'recent_prs' in platoon_personnel.columns:
+                    if caps['recent_prs']:
                         display_cols.append('recent_prs')
                     
                     available_cols = [col for col in display_cols if col in platoon_personnel.columns]
@@ -2432,46 +2190,62 @@ def fitness_team_overview(sheets_manager):
                         st.dataframe(display_df, use_container_width=True, height=200)
         
         # Personnel Progress Search
+        progress_search_section(df)
+            
+    except Exception as e:
+        st.error(f"Error loading fitness team overview: {str(e)}")
+
+@st.fragment
+def progress_search_section(df):
+    """Progress search table - fragment, so filter changes only rerun this section"""
+    try:
         st.subheader("🔍 Progress Search")
-        
-        col1, col2, col3 = st.columns([2, 1, 1])
-        with col1:
-            search_term = st.text_input("Search by name:", placeholder="Type name to search...", key="fitness_search")
-        with col2:
-            progress_filter = st.selectbox("Progress Status:", ["All", "Active", "High Performers", "Need Support"], key="fitness_progress")
-        with col3:
-            min_sessions = st.number_input("Min Sessions:", min_value=0, value=0, key="fitness_min_sessions")
-        
-        # Apply filters
-        filtered_df = df.copy()
+
+        # Same submit-to-apply form as the personnel search - typing does not rerun per keystroke
+        with st.form("progress_filters", border=False):
+            col1, col2, col3 = st.columns([2, 1, 1])
+            with col1:
+                search_term = st.text_input("Search by name:", placeholder="Type name to search...", key="fitness_search")
+            with col2:
+                progress_filter = st.selectbox("Progress Status:", ["All", "Active", "High Performers", "Need Support"], key="fitness_progress")
+            with col3:
+                min_sessions = st.number_input("Min Sessions:", min_value=0, value=0, key="fitness_min_sessions")
+            st.form_submit_button("Apply")
+
+        # Apply filters - one boolean mask, one final selection, no intermediate copies
+        workouts = df['recent_workouts'].to_numpy()
+        mask = np.ones(len(df), dtype=bool)
         if search_term:
-            filtered_df = filtered_df[
-                filtered_df['name'].str.contains(search_term, case=False, na=False) |
-                filtered_df['username'].str.contains(search_term, case=False, na=False)
-            ]
-        
+            term = search_term.lower()
+            mask &= (
+                df['_name_lower'].str.contains(term, regex=False, na=False) |
+                df['_username_lower'].str.contains(term, regex=False, na=False)
+            ).to_numpy()
+
         if progress_filter == "Active":
-            filtered_df = filtered_df[filtered_df['recent_workouts'] > 0]
+            mask &= workouts > 0
         elif progress_filter == "High Performers":
-            # Top 25% by session count
-            threshold = filtered_df['recent_workouts'].quantile(0.75) if len(filtered_df) > 0 else 0
-            filtered_df = filtered_df[filtered_df['recent_workouts'] >= threshold]
+            # Top 25% by session count among the name matches
+            threshold = df.loc[mask, 'recent_workouts'].quantile(0.75) if mask.any() else 0
+            mask &= workouts >= threshold
         elif progress_filter == "Need Support":
-            filtered_df = filtered_df[filtered_df['recent_workouts'] == 0]
-        
+            mask &= workouts == 0
+
         if min_sessions > 0:
-            filtered_df = filtered_df[filtered_df['recent_workouts'] >= min_sessions]
-        
+            mask &= workouts >= min_sessions
+
+        filtered_df = df.loc[mask]
+
         # Display filtered results
         if len(filtered_df) > 0:
             st.markdown(f"**Found {len(filtered_df)} personnel**")
-            
+
             display_cols = ['rank', 'name', 'platoon', 'recent_workouts', 'last_workout_date']
             if 'max_weight_lifted' in filtered_df.columns:
                 display_cols.append('max_weight_lifted')
             if 'recent_prs' in filtered_df.columns:
                 display_cols.append('recent_prs')
-            
+
             available_cols = [col for col in display_cols if col in filtered_df.columns]
             if available_cols:
                 table_df = filtered_df[available_cols].copy()
@@ -2482,12 +2256,11 @@ def fitness_team_overview(sheets_manager):
                     col_names.append('Recent PRs')
                 table_df.columns = col_names[:len(available_cols)]
                 table_df = table_df.sort_values('30-Day Sessions', ascending=False)
-                st.dataframe(table_df, use_container_width=True)
+                display_dataframe_quickly(table_df, key="progress_slider", use_container_width=True)
         else:
             st.info("No personnel found matching the criteria.")
-            
     except Exception as e:
-        st.error(f"Error loading fitness team overview: {str(e)}")
+        st.error(f"Error loading progress search: {str(e)}")
 
 def get_all_fitness_data(sheets_manager):
     """Get fitness data for all personnel with progress tracking"""
@@ -2499,66 +2272,73 @@ def get_all_fitness_data(sheets_manager):
         except:
             return []
         
-        # Get personnel qualifications for names and ranks
-        personnel_data = []
-        
-        # Group fitness data by username and calculate stats
-        from collections import defaultdict
-        user_workouts = defaultdict(list)
+        # Accumulate per-user stats in a single pass over the records
+        thirty_days_ago = datetime.now() - timedelta(days=30)
+        user_stats = {}
         
         for record in fitness_records:
             username = record.get('Username', '').strip()
-            if username:
-                user_workouts[username].append(record)
-        
-        # Calculate fitness metrics for each user
-        for username, workouts in user_workouts.items():
-            # Get user qualifications for rank and name
-            user_quals = sheets_manager.check_user_qualifications(username)
-            
-            # Calculate recent workouts (last 30 days)
-            from datetime import datetime, timedelta
-            thirty_days_ago = datetime.now() - timedelta(days=30)
-            recent_workouts = 0
-            last_workout_date = "Never"
-            max_weight_lifted = 0
-            recent_prs = 0
-            weight_progression = []
+            if not username:
+                continue
+            
+            stats = user_stats.get(username)
+            if stats is None:
+                stats = user_stats[username] = {
+                    'total_workouts': 0,
+                    'recent_workouts': 0,
+                    'last_workout': None,
+                    'last_workout_date': "Never",
+                    'max_weight_lifted': 0,
+                    'recent_prs': 0,
+                    'first_weight': 0,
+                    'last_weight': 0,
+                    'weight_entries': 0
+                }
+            stats['total_workouts'] += 1
             
-            for workout in workouts:
-                try:
-                    workout_date_str = workout.get('Date', '')
-                    if workout_date_str:
-                        workout_date = datetime.strptime(workout_date_str, '%Y-%m-%d')
+            try:
+                workout_date_str = record.get('Date', '')
+                if workout_date_str:
+                    workout_date = datetime.strptime(workout_date_str, '%Y-%m-%d')
+                    
+                    # Track recent activity
+                    if workout_date >= thirty_days_ago:
+                        stats['recent_workouts'] += 1
                         
-                        # Track recent activity
-                        if workout_date >= thirty_days_ago:
-                            recent_workouts += 1
-                            
-                            # Track weight progression
-                            try:
-                                weight = float(workout.get('Weight', 0) or 0)
-                                if weight > 0:
-                                    weight_progression.append(weight)
-                                    max_weight_lifted = max(max_weight_lifted, weight)
-                            except:
-                                pass
-                            
-                            # Count personal records (simplified: any workout with weight > previous max)
-                            if weight > max_weight_lifted * 0.95:  # Within 5% counts as potential PR
-                                recent_prs += 1
+                        # Track weight progression (only first and last weights are needed)
+                        try:
+                            weight = float(record.get('Weight', 0) or 0)
+                        except:
+                            weight = 0
+                        if weight > 0:
+                            if stats['weight_entries'] == 0:
+                                stats['first_weight'] = weight
+                            stats['last_weight'] = weight
+                            stats['weight_entries'] += 1
+                            stats['max_weight_lifted'] = max(stats['max_weight_lifted'], weight)
                         
-                        # Track most recent workout
-                        if last_workout_date == "Never" or workout_date > datetime.strptime(last_workout_date, '%Y-%m-%d'):
-                            last_workout_date = workout_date_str
-                except:
-                    continue
+                        # Count personal records (simplified: any workout with weight > previous max)
+                        if weight > stats['max_weight_lifted'] * 0.95:  # Within 5% counts as potential PR
+                            stats['recent_prs'] += 1
+                    
+                    # Track most recent workout
+                    if stats['last_workout'] is None or workout_date > stats['last_workout']:
+                        stats['last_workout'] = workout_date
+                        stats['last_workout_date'] = workout_date_str
+            except:
+                continue
+        
+        # Get personnel qualifications for names and ranks
+        personnel_data = []
+        
+        for username, stats in user_stats.items():
+            user_quals = sheets_manager.check_user_qualifications(username)
             
             # Calculate weight increase trend
             weight_increase = 0
             progress_trend = 'stable'
-            if len(weight_progression) >= 2:
-                weight_increase = weight_progression[-1] - weight_progression[0]
+            if stats['weight_entries'] >= 2:
+                weight_increase = stats['last_weight'] - stats['first_weight']
                 if weight_increase > 2:
                     progress_trend = 'improving'
                 elif weight_increase < -2:
@@ -2569,15 +2349,15 @@ def get_all_fitness_data(sheets_manager):
                 'name': user_quals.get('full_name', username),
                 'rank': user_quals.get('rank', ''),
                 'platoon': user_quals.get('platoon', 'Unknown'),
-                'recent_workouts': recent_workouts,
-                'total_workouts': len(workouts),
-                'last_workout_date': last_workout_date,
-                'max_weight_lifted': max_weight_lifted,
-                'recent_prs': recent_prs,
+                'recent_workouts': stats['recent_workouts'],
+                'total_workouts': stats['total_workouts'],
+                'last_workout_date': stats['last_workout_date'],
+                'max_weight_lifted': stats['max_weight_lifted'],
+                'recent_prs': stats['recent_prs'],
                 'weight_increase': weight_increase,
                 'progress_trend': progress_trend,
                 'avg_weight_increase': weight_increase,
-                'personal_records': recent_prs
+                'personal_records': stats['recent_prs']
             })
         
         return personnel_data
@@ -2586,10 +2366,24 @@ def get_all_fitness_data(sheets_manager):
         print(f"Error getting fitness data: {e}")
         return []
 
+def _mileage_owner():
+    """Key identifying this browser session's queued mileage rows"""
+    return st.session_state.get('session_token') or st.session_state.username
+
 def log_mileage_tab(sheets_manager):
     """Mileage logging interface"""
     st.header("Log Vehicle Mileage")
     
+    # Surface this session's queued mileage logs that failed to save in the background
+    for error in sheets_manager.pop_flush_errors(_mileage_owner()):
+        st.toast(f"⚠️ {error} - will retry")
+    
+    # Confirmation for the log queued on the previous run (elements before st.rerun() are discarded)
+    notice = st.session_state.pop('mileage_notice', None)
+    if notice:
+        st.success("✅ Mileage log queued - it will be saved to Google Sheets within a few seconds")
+        st.info(notice)
+    
     # Check user qualifications first
     try:
         qualifications = sheets_manager.check_user_qualifications(st.session_state.username)
@@ -2602,14 +2396,16 @@ def log_mileage_tab(sheets_manager):
         st.error(f"Failed to check qualifications: {str(e)}")
         return
     
+    today = datetime.now().date()
+    
     with st.form("mileage_form"):
         col1, col2 = st.columns(2)
         
         with col1:
             operation_date = st.date_input(
                 "Date of Drive",
-                value=datetime.now().date(),
-                max_value=datetime.now().date()
+                value=today,
+                max_value=today
             )
         
         with col2:
@@ -2662,22 +2458,9 @@ def log_mileage_tab(sheets_manager):
                 placeholder="Enter ending mileage"
             )
         
-        # Calculate distance automatically
-        if initial_mileage is not None and final_mileage is not None:
-            if final_mileage > initial_mileage:
-                distance_driven = final_mileage - initial_mileage
-                st.info(f"Distance Driven: {distance_driven:.1f} KM")
-            else:
-                distance_driven = 0.0
-                st.error("Final mileage must be greater than initial mileage")
-        else:
-            distance_driven = 0.0
-            if initial_mileage is not None and final_mileage is not None:
-                st.info("Enter both initial and final mileage to calculate distance")
-        
         submit_button = st.form_submit_button("Log Mileage", type="primary")
         
-        if submit_button:
+        if submit_button and check_rate_limit():
             # Validation
             if not vehicle_no.strip():
                 st.error("Please enter a vehicle number (MID)")
@@ -2695,6 +2478,9 @@ def log_mileage_tab(sheets_manager):
                 st.error("Final mileage must be greater than initial mileage")
                 return
             
+            # Calculate distance only once the form is submitted
+            distance_driven = final_mileage - initial_mileage
+            
             if distance_driven <= 0:
                 st.error("Distance driven must be greater than 0")
                 return
@@ -2709,17 +2495,13 @@ def log_mileage_tab(sheets_manager):
                     'Final_Mileage_KM': final_mileage,
                     'Distance_Driven_KM': distance_driven,
                     'Vehicle_Type': vehicle_type,
-                    'Timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    'Timestamp': _now_str()
                 }
                 
-                # Save to Google Sheets
-                sheets_manager.add_mileage_log(log_data)
-                
-                # Clear caches to ensure dashboard updates immediately
-                sheets_manager.clear_caches()
+                # Queue for Google Sheets - the batched flush clears the mileage caches once written
+                sheets_manager.add_mileage_log(log_data, owner=_mileage_owner())
                 
-                st.success(f"✅ Mileage logged successfully!")
-                st.info(f"**Date:** {operation_date.strftime('%Y-%m-%d')} | **Vehicle:** {vehicle_type} ({vehicle_no}) | **Distance:** {distance_driven:.1f} KM")
+                st.session_state.mileage_notice = f"**Date:** {operation_date.strftime('%Y-%m-%d')} | **Vehicle:** {vehicle_type} ({vehicle_no}) | **Distance:** {distance_driven:.1f} KM"
                 
                 # Force refresh the page to show updated data
                 st.rerun()
@@ -2727,147 +2509,238 @@ def log_mileage_tab(sheets_manager):
             except Exception as e:
                 st.error(f"Failed to log mileage: {str(e)}")
 
+def _render_vehicle_status(label, emoji, qualified, data):
+    """Render one vehicle type's currency block from its tracker sheet record"""
+    st.subheader(f"{emoji} {label} Status")
+    
+    if not qualified:
+        st.info(f"❌ Not qualified for {label}")
+        return
+    
+    if not data:
+        st.info(f"No {label} driving data available yet")
+        return
+    
+    status = str(data.get('Currency Maintained') or '').upper()
+    distance_3_months = data.get('Distance in Last 3 Months', 0.0)
+    
+    if status == 'YES':
+        st.success("✅ CURRENT")
+        st.write(f"**3-Month Distance:** {distance_3_months:.1f} KM")
+    elif status == 'NO':
+        st.error("❌ NOT CURRENT")
+        st.write(f"**3-Month Distance:** {distance_3_months:.1f} KM")
+        st.write("**Required:** 2.0 KM minimum")
+    else:
+        st.info("⚠️ Status unknown")
+    
+    expiry_date = data.get('Lapsing Date', 'N/A')
+    if expiry_date != 'N/A':
+        st.write(f"**Expiry Date:** {expiry_date}")
+    
+    last_drive = data.get('Last Driven Date', 'N/A')
+    if last_drive != 'N/A':
+        st.write(f"**Last Drive:** {last_drive}")
+
+@st.cache_data(ttl=600, max_entries=64, show_spinner=False)
+def _mileage_history_view(username, signature, _user_data):
+    """Formatted mileage history table and summary stats, keyed on the user and a signature of the logs"""
+    # Dates stay datetime64 - st.dataframe formats them client-side for the visible rows only
+    display_data = _user_data[['Date_of_Drive', 'Vehicle_Type', 'Vehicle_No_MID', 'Distance_Driven_KM']].sort_values('Date_of_Drive', ascending=False)
+    display_data.columns = ['Date', 'Vehicle Type', 'Vehicle No.', 'Distance (KM)']
+    
+    # One grouped pass - totals and the mean are derived from the per-vehicle sums and counts
+    by_vehicle = _user_data.groupby('Vehicle_Type', observed=True, dropna=False)['Distance_Driven_KM'].agg(['sum', 'count', 'size'])
+    total = float(by_vehicle['sum'].sum())
+    counted = int(by_vehicle['count'].sum())
+    stats = {
+        'total': total,
+        'mean': total / counted if counted else float('nan'),
+        'terrex': int(by_vehicle['size'].get('Terrex', 0)),
+        'belrex': int(by_vehicle['size'].get('Belrex', 0))
+    }
+    return display_data, stats
+
 def currency_status_tab(sheets_manager):
     """Currency status tracking"""
     st.header("Currency Status")
     
     try:
-        # Check user qualifications first
-        qualifications = sheets_manager.check_user_qualifications(st.session_state.username)
+        # Qualifications, tracker data (currency status comes from tracker sheets, not
+        # mileage logs) and mileage history in a single Sheets round trip
+        qualifications, tracker_data, user_data = sheets_manager.get_currency_bundle(st.session_state.username)
         
         if not qualifications['terrex'] and not qualifications['belrex']:
             st.error("❌ You are not qualified for any vehicle type.")
             return
         
-        # Get user's tracker data (currency status comes from tracker sheets, not mileage logs)
-        tracker_data = sheets_manager.get_user_tracker_data(st.session_state.username)
-        
         # Display status for each vehicle type
         col1, col2 = st.columns(2)
         
         with col1:
-            st.subheader("🚗 Terrex Status")
-            if qualifications['terrex']:
-                if tracker_data['terrex']:
-                    terrex_data = tracker_data['terrex']
-                    currency_status = terrex_data.get('Currency Maintained', 'N/A')
-                    distance_3_months = float(terrex_data.get('Distance in Last 3 Months', 0) or 0)
-                    
-                    if currency_status.upper() == 'YES':
-                        st.success("✅ CURRENT")
-                        st.write(f"**3-Month Distance:** {distance_3_months:.1f} KM")
-                    elif currency_status.upper() == 'NO':
-                        st.error("❌ NOT CURRENT")
-                        st.write(f"**3-Month Distance:** {distance_3_months:.1f} KM")
-                        st.write("**Required:** 2.0 KM minimum")
-                    else:
-                        st.info("⚠️ Status unknown")
-                    
-                    expiry_date = terrex_data.get('Lapsing Date', 'N/A')
-                    if expiry_date != 'N/A':
-                        st.write(f"**Expiry Date:** {expiry_date}")
-                    
-                    last_drive = terrex_data.get('Last Driven Date', 'N/A')
-                    if last_drive != 'N/A':
-                        st.write(f"**Last Drive:** {last_drive}")
-                else:
-                    st.info("No Terrex driving data available yet")
-            else:
-                st.info("❌ Not qualified for Terrex")
+            _render_vehicle_status("Terrex", "🚗", qualifications['terrex'], tracker_data['terrex'])
         
         with col2:
-            st.subheader("🚛 Belrex Status")
-            if qualifications['belrex']:
-                if tracker_data['belrex']:
-                    belrex_data = tracker_data['belrex']
-                    currency_status = belrex_data.get('Currency Maintained', 'N/A')
-                    distance_3_months = float(belrex_data.get('Distance in Last 3 Months', 0) or 0)
-                    
-                    if currency_status.upper() == 'YES':
-                        st.success("✅ CURRENT")
-                        st.write(f"**3-Month Distance:** {distance_3_months:.1f} KM")
-                    elif currency_status.upper() == 'NO':
-                        st.error("❌ NOT CURRENT")
-                        st.write(f"**3-Month Distance:** {distance_3_months:.1f} KM")
-                        st.write("**Required:** 2.0 KM minimum")
-                    else:
-                        st.info("⚠️ Status unknown")
-                    
-                    expiry_date = belrex_data.get('Lapsing Date', 'N/A')
-                    if expiry_date != 'N/A':
-                        st.write(f"**Expiry Date:** {expiry_date}")
-                    
-                    last_drive = belrex_data.get('Last Driven Date', 'N/A')
-                    if last_drive != 'N/A':
-                        st.write(f"**Last Drive:** {last_drive}")
-                else:
-                    st.info("No Belrex driving data available yet")
-            else:
-                st.info("❌ Not qualified for Belrex")
+            _render_vehicle_status("Belrex", "🚛", qualifications['belrex'], tracker_data['belrex'])
         
         # Currency rules explanation
-        st.info("""
-        **Currency Rules:**
-        - ✅ **Current:** 2.0 KM or more driven in the last 3 months
-        - ❌ **Not Current:** Less than 2.0 KM driven in the last 3 months
-        - **Expiry:** Currency expires 3 months after last 2.0 KM cumulative drive
-        """)
+        st.info(_CURRENCY_RULES_MD)
         
         # Historical data
         st.subheader("Mileage History")
         
-        # Get user's mileage logs
-        user_data = sheets_manager.get_user_data(st.session_state.username)
-        
         if not user_data.empty:
-            # Display all user data
-            display_data = user_data[['Date_of_Drive', 'Vehicle_Type', 'Vehicle_No_MID', 'Distance_Driven_KM']].copy()
-            display_data['Date_of_Drive'] = display_data['Date_of_Drive'].dt.strftime("%Y-%m-%d")
-            display_data.columns = ['Date', 'Vehicle Type', 'Vehicle No.', 'Distance (KM)']
-            display_data = display_data.sort_values('Date', ascending=False)
+            # Cheap signature of the logs - the formatted table and stats are rebuilt only when it changes
+            signature = (len(user_data), user_data['Date_of_Drive'].max(), float(user_data['Distance_Driven_KM'].sum()))
+            display_data, stats = _mileage_history_view(st.session_state.username, signature, user_data)
             
-            st.dataframe(display_data, use_container_width=True)
+            st.dataframe(display_data, use_container_width=True,
+                         column_config={'Date': st.column_config.DateColumn(format="YYYY-MM-DD")})
             
             # Summary statistics
             st.subheader("Summary Statistics")
             col1, col2, col3 = st.columns(3)
             
             with col1:
-                st.metric("Total Distance", f"{user_data['Distance_Driven_KM'].sum():.1f} KM")
+                st.metric("Total Distance", f"{stats['total']:.1f} KM")
             
             with col2:
-                st.metric("Average Distance", f"{user_data['Distance_Driven_KM'].mean():.1f} KM")
+                st.metric("Average Distance", f"{stats['mean']:.1f} KM")
             
             with col3:
-                terrex_count = len(user_data[user_data['Vehicle_Type'] == 'Terrex'])
-                belrex_count = len(user_data[user_data['Vehicle_Type'] == 'Belrex'])
-                st.metric("Terrex/Belrex Logs", f"{terrex_count}/{belrex_count}")
+                st.metric("Terrex/Belrex Logs", f"{stats['terrex']}/{stats['belrex']}")
         else:
             st.info("No mileage logs found in the app yet. Start logging your drives!")
         
     except Exception as e:
         st.error(f"Error loading currency status: {str(e)}")
 
+def _now_str():
+    """Current local time as a YYYY-MM-DD HH:MM:SS string"""
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+# Accounts treated as commanders when their entry predates the is_admin field (matches auth.py)
+LEGACY_ADMINS = ('admin', 'trooper1', 'trooper2', 'commander')
+
+def _normalize_credentials(credentials):
+    """Convert legacy string entries to the dict format and fill in is_admin, in place"""
+    for username, details in credentials.items():
+        if not isinstance(details, dict):
+            credentials[username] = {
+                "password": details,
+                "is_admin": username in LEGACY_ADMINS,
+                "created_by": "Legacy"
+            }
+        elif 'is_admin' not in details:
+            details['is_admin'] = username in LEGACY_ADMINS
+    return credentials
+
+def _load_credentials():
+    """Load credentials into session state, re-reading the file only when its mtime changes"""
+    pending = st.session_state.get('cred_write')
+    if pending is not None:
+        if not pending.done():
+            # Our own write is still queued - the session copy is newer than the file
+            return st.session_state.credentials
+        
+        del st.session_state['cred_write']
+        try:
+            pending.result()
+        except Exception as e:
+            st.error(f"Failed to save credentials: {str(e)}")
+        # Force a fresh read - the file may also hold other writers' changes merged in by the write
+        st.session_state.pop('cred_mtime', None)
+    
+    mtime = os.path.getmtime('credentials.json')
+    if 'credentials' not in st.session_state or st.session_state.get('cred_mtime') != mtime:
+        with open('credentials.json', 'rb') as f:
+            raw = f.read()
+        # Normalized once here; the dict format is persisted on the next save
+        st.session_state.credentials = _normalize_credentials(orjson.loads(raw) if orjson else json.loads(raw))
+        st.session_state.cred_mtime = mtime
+    return st.session_state.credentials
+
+# Single background writer - admin edits go through auth.update_credentials off the request thread
+_credentials_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="credentials-writer")
+
+def _save_credentials(credentials, change):
+    """Apply change to the session copy now and queue it against a fresh read of credentials.json"""
+    change(credentials)
+    st.session_state.credentials = credentials
+    # Provisional version key for cached views until the write lands and the file is re-read
+    st.session_state.cred_mtime = time.time()
+    
+    def apply(fresh):
+        # Legacy entries are converted to the dict format whenever the file is saved
+        change(_normalize_credentials(fresh))
+        return True
+    
+    # auth serializes this with logins that rehash legacy passwords, so neither write drops the other
+    # The write changes the file's mtime, which also refreshes _valid_users for session restore
+    st.session_state.cred_write = _credentials_writer.submit(update_credentials, apply)
+
+def _update_account(username, changes):
+    """Credentials change that updates username's entry, skipping accounts deleted in the meantime"""
+    def change(credentials):
+        if username in credentials:
+            credentials[username].update(changes)
+    return change
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def _account_index(cred_mtime, _credentials, name_lookup):
+    """Build the account list frame and modify-tab options in one pass, keyed on the credentials mtime"""
+    # Parallel column lists - DataFrame builds the blocks directly from these
+    usernames, full_names, account_types, list_search = [], [], [], []
+    account_options = ['']
+    account_display = {'': ''}
+    search_index = []
+    
+    for username, details in _credentials.items():
+        # Exclude main admin from list
+        if username == 'admin':
+            continue
+        
+        full_name = name_lookup.get(username, 'Not in tracker sheets')
+        usernames.append(username)
+        full_names.append(full_name)
+        account_types.append('Commander' if details['is_admin'] else 'Trooper')
+        list_search.append(f"{username}\x00{full_name}".lower())
+        
+        account_options.append(username)
+        account_display[username] = f"{username} - {name_lookup.get(username, 'Name not found')}"
+        # Display text already contains the username, so one lowercase string covers both searches
+        search_index.append((username, account_display[username].lower()))
+    
+    account_df = pd.DataFrame({'Username': usernames, 'Full Name': full_names, 'Type': account_types})
+    return account_df, pd.Series(list_search, dtype=object), account_options, account_display, search_index
+
 def account_management_tab(sheets_manager):
     """Revamped account management for main admin"""
     try:
-        # Load current credentials
-        import json
+        # Load current credentials (re-read only when the file changes)
         try:
-            with open('credentials.json', 'r') as f:
-                credentials = json.load(f)
+            credentials = _load_credentials()
         except FileNotFoundError:
             st.error("Credentials file not found.")
             return
         
-        # Filter accounts (exclude main admin from list)
-        manageable_accounts = {k: v for k, v in credentials.items() if k != 'admin'}
-        
-        if not manageable_accounts:
+        # Main admin is excluded from the lists - _account_index skips it, so no filtered copy is needed
+        if len(credentials) - ('admin' in credentials) == 0:
             st.info("No user accounts found.")
             return
         
-
+        # Get all user names (not just qualified) - get_all_personnel_names is
+        # st.cache_data backed, so this is shared across sessions for 2 hours
+        try:
+            name_lookup = sheets_manager.get_all_personnel_names()
+        except Exception as e:
+            st.error(f"Error loading names: {str(e)}")
+            name_lookup = {}
+        
+        # Account rows and selector options, rebuilt only when credentials.json changes
+        account_df, account_list_search, all_account_options, account_display, search_index = _account_index(
+            st.session_state.cred_mtime, credentials, name_lookup
+        )
         
         # Account Management Sections
         tab1, tab2 = st.tabs(["Account List", "Modify Account"])
@@ -2882,44 +2755,13 @@ def account_management_tab(sheets_manager):
             with col2:
                 filter_type = st.selectbox("Filter by type:", ["All", "Commander", "Trooper"], key="account_filter")
             
-            # Get all user names efficiently - use dedicated function for ALL names (not just qualified)
-            # Use session state cache to avoid repeated API calls
-            if 'name_lookup_cache' not in st.session_state or time.time() - st.session_state.get('name_lookup_timestamp', 0) > 7200:
-                try:
-                    name_lookup = sheets_manager.get_all_personnel_names()
-                    st.session_state.name_lookup_cache = name_lookup
-                    st.session_state.name_lookup_timestamp = time.time()
-                except Exception as e:
-                    st.error(f"Error loading names: {str(e)}")
-                    name_lookup = {}
-            else:
-                name_lookup = st.session_state.name_lookup_cache
-            
             # Enhanced account display with full names
-            account_data = []
-            for username, details in manageable_accounts.items():
-                # Get display name from lookup or fallback
-                display_name = name_lookup.get(username, 'Not in tracker sheets')
-                
-                # Handle different credential formats
-                if isinstance(details, dict):
-                    is_admin = details.get('is_admin', username in ['trooper1', 'trooper2', 'commander'])
-                else:
-                    is_admin = username in ['trooper1', 'trooper2', 'commander']
-                
-                account_data.append({
-                    'Username': username,
-                    'Full Name': display_name,
-                    'Type': 'Commander' if is_admin else 'Trooper'
-                })
-            
-            df = pd.DataFrame(account_data)
+            df = account_df
             
-            # Apply search filter (search both username and full name)
+            # Apply search filter (search both username and full name) on the
+            # precomputed lowercase column - the NUL separator keeps matches within one field
             if search_term:
-                mask = (df['Username'].str.contains(search_term, case=False, na=False) |
-                       df['Full Name'].str.contains(search_term, case=False, na=False))
-                df = df[mask]
+                df = df[account_list_search.str.contains(search_term.lower(), regex=False).to_numpy()]
             
             # Apply type filter
             if filter_type != "All":
@@ -2937,36 +2779,21 @@ def account_management_tab(sheets_manager):
             # Search box for finding accounts quickly
             search_modify = st.text_input("Search for account to modify:", placeholder="Type name or username...", key="modify_search")
             
-            # Create options with full names for easy identification
-            account_options = ['']
-            account_display = {'': ''}
-            
-            # Get name lookup for dropdown - use cached version
-            if 'name_lookup_cache' not in st.session_state or time.time() - st.session_state.get('name_lookup_timestamp', 0) > 7200:
-                try:
-                    name_lookup = sheets_manager.get_all_personnel_names()
-                    st.session_state.name_lookup_cache = name_lookup
-                    st.session_state.name_lookup_timestamp = time.time()
-                except:
-                    name_lookup = {}
-            else:
-                name_lookup = st.session_state.name_lookup_cache
-            
-            for username in manageable_accounts.keys():
-                full_name = name_lookup.get(username, 'Name not found')
-                display_text = f"{username} - {full_name}"
-                account_options.append(username)
-                account_display[username] = display_text
+            # Options with full names for easy identification
+            account_options = all_account_options
             
-            # Filter options based on search
+            # Filter options based on search - when the term extends the previous
+            # one, only the previous matches need to be scanned again
             if search_modify:
-                filtered_options = ['']
-                for username in manageable_accounts.keys():
-                    display_text = account_display[username]
-                    if (search_modify.lower() in username.lower() or 
-                        search_modify.lower() in display_text.lower()):
-                        filtered_options.append(username)
-                account_options = filtered_options
+                term = search_modify.lower()
+                last_mtime, last_term, last_matches = st.session_state.get('modify_search_last', (None, '', None))
+                candidates = search_index
+                if last_matches is not None and last_mtime == st.session_state.cred_mtime and term.startswith(last_term):
+                    candidates = last_matches
+                
+                matches = [entry for entry in candidates if term in entry[1]]
+                st.session_state.modify_search_last = (st.session_state.cred_mtime, term, matches)
+                account_options = [''] + [username for username, _ in matches]
             
             col1, col2 = st.columns([1, 2])
             
@@ -2979,21 +2806,10 @@ def account_management_tab(sheets_manager):
                 )
             
             if selected_user:
-                current_details = manageable_accounts[selected_user]
-                if isinstance(current_details, dict):
-                    current_is_admin = current_details.get('is_admin', selected_user in ['trooper1', 'trooper2', 'commander'])
-                else:
-                    current_is_admin = selected_user in ['trooper1', 'trooper2', 'commander']
+                current_is_admin = credentials[selected_user]['is_admin']
                 
-                # Get user's full name from the lookup - use cached version
-                try:
-                    if 'name_lookup_cache' in st.session_state:
-                        display_name = st.session_state.name_lookup_cache.get(selected_user, 'Not in tracker sheets')
-                    else:
-                        name_lookup = sheets_manager.get_all_personnel_names()
-                        display_name = name_lookup.get(selected_user, 'Not in tracker sheets')
-                except:
-                    display_name = 'Error loading name'
+                # Get user's full name from the lookup
+                display_name = name_lookup.get(selected_user, 'Not in tracker sheets')
                 
                 with col2:
                     status_color = "Commander" if current_is_admin else "Trooper"
@@ -3016,21 +2832,12 @@ def account_management_tab(sheets_manager):
                     
                     if st.button("Update Privileges", key="update_privileges", use_container_width=True):
                         # Update credentials logic
-                        if isinstance(credentials[selected_user], dict):
-                            credentials[selected_user]['is_admin'] = new_admin_status
-                            credentials[selected_user]['modified_by'] = st.session_state.username
-                            credentials[selected_user]['modified_date'] = pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")
-                        else:
-                            credentials[selected_user] = {
-                                "password": credentials[selected_user],
-                                "is_admin": new_admin_status,
-                                "created_by": "Legacy",
-                                "modified_by": st.session_state.username,
-                                "modified_date": pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")
-                            }
-                        
-                        with open('credentials.json', 'w') as f:
-                            json.dump(credentials, f, indent=2)
+                        changes = {
+                            "is_admin": new_admin_status,
+                            "modified_by": st.session_state.username,
+                            "modified_date": _now_str()
+                        }
+                        _save_credentials(credentials, _update_account(selected_user, changes))
                         
                         status_change = "granted" if new_admin_status else "revoked"
                         st.success(f"Commander privileges {status_change} for '{selected_user}'")
@@ -3042,24 +2849,13 @@ def account_management_tab(sheets_manager):
                     
                     if st.button("Reset Password", key="reset_password", use_container_width=True):
                         if new_password:
-                            import hashlib
-                            hashed_password = hashlib.sha256(new_password.encode()).hexdigest()
-                            
-                            if isinstance(credentials[selected_user], dict):
-                                credentials[selected_user]['password'] = hashed_password
-                                credentials[selected_user]['modified_by'] = st.session_state.username
-                                credentials[selected_user]['modified_date'] = pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")
-                            else:
-                                credentials[selected_user] = {
-                                    "password": hashed_password,
-                                    "is_admin": selected_user in ['trooper1', 'trooper2', 'commander'],
-                                    "created_by": "Legacy",
-                                    "modified_by": st.session_state.username,
-                                    "modified_date": pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")
-                                }
-                            
-                            with open('credentials.json', 'w') as f:
-                                json.dump(credentials, f, indent=2)
+                            changes = {
+                                "password": hash_password_scrypt(new_password),
+                                "hash_alg": "scrypt",
+                                "modified_by": st.session_state.username,
+                                "modified_date": _now_str()
+                            }
+                            _save_credentials(credentials, _update_account(selected_user, changes))
                             
                             st.success(f"Password reset for '{selected_user}'")
                             st.rerun()
@@ -3072,11 +2868,10 @@ def account_management_tab(sheets_manager):
                         st.info("Built-in commander accounts cannot be deleted")
                     else:
                         if st.button("Delete Account", key="delete_account", type="secondary", use_container_width=True):
-                            if 'confirm_delete' not in st.session_state:
-                                st.session_state.confirm_delete = True
-                                st.rerun()
+                            st.session_state.confirm_delete = True
+                            st.rerun()
                         
-                        if getattr(st.session_state, 'confirm_delete', False):
+                        if st.session_state.get('confirm_delete', False):
                             st.warning("Are you sure? This action cannot be undone.")
                             col_cancel, col_confirm = st.columns(2)
                             with col_cancel:
@@ -3084,10 +2879,9 @@ def account_management_tab(sheets_manager):
                                     st.session_state.confirm_delete = False
                                     st.rerun()
                             with col_confirm:
-                                if st.button("Confirm Delete", key="confirm_delete", type="secondary"):
-                                    del credentials[selected_user]
-                                    with open('credentials.json', 'w') as f:
-                                        json.dump(credentials, f, indent=2)
+                                # Own widget key - sharing "confirm_delete" let the button's value overwrite the flag
+                                if st.button("Confirm Delete", key="confirm_delete_btn", type="secondary"):
+                                    _save_credentials(credentials, lambda creds: creds.pop(selected_user, None))
                                     st.success(f"Account '{selected_user}' deleted")
                                     st.session_state.confirm_delete = False
                                     st.rerun()
@@ -3298,83 +3092,82 @@ def main():
     else:
         main_app()
 
+def _start_browser_session(username, token, expires_at):
+    """Mark the session logged in and queue the session cookie write - shared by login and restore"""
+    st.session_state.logged_in = True
+    st.session_state.username = username
+    st.session_state.login_time = time.time()
+    st.session_state.session_token = token
+    
+    # Emitted by main() - the login run ends in st.rerun(), which would drop the element unrendered
+    st.session_state.pending_cookie_js = _LOGIN_STORAGE_JS.format(
+        cookie=_SESSION_COOKIE,
+        token=json.dumps(token),
+        max_age=max(0, expires_at - int(time.time()))
+    )
+
 def restore_session():
-    """Restore user session from browser storage if available"""
-    if st.session_state.get('logged_in', False):
+    """Restore user session from the browser's session cookie if available"""
+    ss = st.session_state
+    if ss.get('logged_in', False):
         return True
     
-    # Use a simpler approach with session state persistence
-    session_js = st.components.v1.html("""
-    <script>
-    const loggedIn = localStorage.getItem('msc_drivr_logged_in');
-    const username = localStorage.getItem('msc_drivr_username');
-    const sessionToken = localStorage.getItem('msc_drivr_session_token');
-    const loginTime = localStorage.getItem('msc_drivr_login_time');
-    
-    // Check if session is still valid (2 hours = 7200 seconds)
-    const currentTime = Math.floor(Date.now() / 1000);
-    const sessionValid = loginTime && (currentTime - parseInt(loginTime)) < 7200;
-    
-    if (loggedIn === 'true' && username && sessionValid) {
-        // Set a flag that Python can check
-        window.sessionRestoreData = {
-            username: username,
-            token: sessionToken,
-            valid: true
-        };
-        
-        // Also try to trigger a state update
-        if (window.parent && window.parent.streamlitRerun) {
-            window.parent.streamlitRerun();
-        }
-    } else {
-        // Clear invalid session data
-        localStorage.removeItem('msc_drivr_logged_in');
-        localStorage.removeItem('msc_drivr_username');
-        localStorage.removeItem('msc_drivr_session_token');
-        localStorage.removeItem('msc_drivr_login_time');
-    }
-    </script>
-    """, height=0)
+    # Cookies are fixed for the lifetime of the websocket, so check once per session
+    if ss.get('restore_attempted', False):
+        return False
+    ss.restore_attempted = True
+    
+    # Read server-side from the request headers - no component iframe or page reload
+    token = st.context.cookies.get(_SESSION_COOKIE)
+    if not token:
+        return False
+    
+    # One atomic lookup that also slides the session expiry forward
+    username, expires_at = refresh_session(token)
+    if username and _user_exists(username):
+        # Re-emitting the cookie keeps its expiry in step with the refreshed server record
+        _start_browser_session(username, token, expires_at)
+        return True
     
     return False
 
-def validate_session_token(username, token):
-    """Simple session token validation"""
-    # Basic validation - in production, use proper JWT or secure tokens
-    expected_token = hashlib.sha256(f"{username}_session_salt".encode()).hexdigest()[:16]
-    return token == expected_token
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _valid_users(cred_mtime) -> frozenset:
+    """Usernames from credentials.json, shared by all sessions and keyed on the file's mtime"""
+    return frozenset(load_credentials())
 
-def generate_session_token(username):
-    """Generate a simple session token"""
-    return hashlib.sha256(f"{username}_session_salt".encode()).hexdigest()[:16]
+def _user_exists(username):
+    """Existence check used by session restore (no password involved)"""
+    # Every write to credentials.json - admin edits, password changes, login rehashes - changes
+    # the mtime, so deleted or new accounts are seen on the next restore
+    try:
+        cred_mtime = os.stat('credentials.json').st_mtime_ns
+    except FileNotFoundError:
+        cred_mtime = None
+    return username in _valid_users(cred_mtime)
 
 def main():
     """Main application controller with session persistence"""
-    # Initialize session state
-    if "logged_in" not in st.session_state:
-        st.session_state.logged_in = False
-    
-    # Try to restore session first
-    if not st.session_state.logged_in:
-        restore_session()
+    # Read session state once - each proxy access takes Streamlit's state lock
+    ss = st.session_state
+    logged_in = ss.get('logged_in', False)
+    if 'logged_in' not in ss:
+        ss.logged_in = False
     
-    # Smart high-load protection: Automatically detects and responds to high load
-    if st.session_state.logged_in:
-        username = st.session_state.get('username', 'unknown')
-        
-        # Check if we're in high load mode and apply rate limiting only then
-        if st.session_state.get('high_load_mode', False):
-            if not check_rate_limit(username):
-                st.error("🚫 System under high load. Please wait 30 seconds and refresh.")
-                st.info("💡 Try again in a moment - protection will automatically disable when load decreases.")
-                st.stop()
+    # Try to restore session
+    if not logged_in:
+        logged_in = restore_session()
     
-    # Periodic memory cleanup every request
+    # Periodic memory cleanup (time-gated inside cleanup_session_memory)
     cleanup_session_memory()
     
+    # Cookie script queued at login/restore/logout, written once in the run after it was queued
+    cookie_js = ss.pop('pending_cookie_js', None)
+    if cookie_js:
+        st.components.v1.html(cookie_js, height=0)
+    
     # Check if user is logged in
-    if not st.session_state.logged_in:
+    if not logged_in:
         login_page()
     else:
         try:
@@ -3382,9 +3175,10 @@ def main():
         except Exception as e:
             st.error(f"Application error: {str(e)}")
             st.info("Please refresh the page. If the problem persists, try again in a few minutes.")
-            # Clear problematic session state
-            if 'sheets_manager' in st.session_state:
-                del st.session_state['sheets_manager']
+            # Only rebuild the shared Sheets connection when the failure came from it -
+            # unrelated errors keep the cached, already-authenticated manager
+            if _is_sheets_connection_error(e):
+                get_sheets_manager.clear()
 
 if __name__ == "__main__":
     main()
@@ -1,12 +1,26 @@
 import json
 import hashlib
+import hmac
+import secrets
 import os
+import tempfile
+import threading
+try:
+    import orjson  # Optional - faster credentials.json reads/writes
+except ImportError:
+    orjson = None
+
+# scrypt cost parameters for new password hashes (~16 MB and tens of ms per hash)
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
 
 def load_credentials():
     """Load user credentials from JSON file"""
     try:
-        with open('credentials.json', 'r') as f:
-            return json.load(f)
+        with open('credentials.json', 'rb') as f:
+            raw = f.read()
+        return orjson.loads(raw) if orjson else json.loads(raw)
     except FileNotFoundError:
         # Return default credentials if file doesn't exist
         return {
@@ -15,13 +29,126 @@ def load_credentials():
             "trooper2": "5994471abb01112afcc18159f6cc74b4f511b99806da59b3caf5a9c173cacfc5"   # "service456"
         }
 
+# Parsed credentials.json shared by read-only lookups, keyed on the file's mtime
+_credentials_cache = {'mtime': None, 'credentials': None}
+_credentials_lock = threading.Lock()
+
+def _cached_credentials():
+    """Credentials for read-only lookups, re-parsed only when credentials.json changes"""
+    try:
+        mtime = os.stat('credentials.json').st_mtime_ns
+    except FileNotFoundError:
+        return load_credentials()
+    
+    with _credentials_lock:
+        if _credentials_cache['mtime'] != mtime:
+            _credentials_cache['credentials'] = load_credentials()
+            _credentials_cache['mtime'] = mtime
+        return _credentials_cache['credentials']
+
+# Serializes every read-modify-write of credentials.json so concurrent writers can't drop each other's changes
+_write_lock = threading.RLock()
+
+def _write_credentials(credentials):
+    """Atomically replace credentials.json and refresh the shared copy so the next lookup skips the re-parse"""
+    # Write a sibling temp file and swap it in - readers never see a half-written file
+    # Serialize before creating the temp file so an encoding error leaves nothing behind
+    if orjson:
+        payload = orjson.dumps(credentials, option=orjson.OPT_INDENT_2)
+    else:
+        payload = json.dumps(credentials, indent=2).encode()
+    
+    directory = os.path.dirname(os.path.abspath('credentials.json'))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+            # Data must be on disk before the rename, or a crash can leave an empty credentials.json
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, 'credentials.json')
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    
+    # Persist the rename itself (POSIX only - directories can't be opened on Windows)
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    
+    with _credentials_lock:
+        _credentials_cache['credentials'] = credentials
+        _credentials_cache['mtime'] = os.stat('credentials.json').st_mtime_ns
+
+def update_credentials(change):
+    """Under the write lock, apply change to a fresh read of credentials.json and save it if change returns True"""
+    with _write_lock:
+        credentials = load_credentials()
+        if not change(credentials):
+            return False
+        _write_credentials(credentials)
+        return True
+
 def hash_password(password):
-    """Hash password using SHA256"""
+    """Hash password using SHA256 (legacy format, only used to verify old entries)"""
     return hashlib.sha256(password.encode()).hexdigest()
 
+def hash_password_scrypt(password):
+    """Hash password with a random salt using scrypt, stored as n$r$p$salt$hash"""
+    salt = secrets.token_bytes(16)
+    digest = hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+    return f"{SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
+
+def verify_password(user_details, password):
+    """Check password against a stored entry, returns (is_valid, needs_rehash)"""
+    # Handle both old format (string) and new format (dict)
+    if isinstance(user_details, dict):
+        stored_hash = user_details.get('password', '')
+        hash_alg = user_details.get('hash_alg', 'sha256')
+    else:
+        # Legacy format - SHA256 hash directly stored
+        stored_hash = user_details
+        hash_alg = 'sha256'
+    
+    if hash_alg == 'scrypt':
+        try:
+            n, r, p, salt_hex, digest_hex = stored_hash.split('$')
+            expected = bytes.fromhex(digest_hex)
+            digest = hashlib.scrypt(password.encode(), salt=bytes.fromhex(salt_hex), n=int(n), r=int(r), p=int(p))
+        except (ValueError, TypeError):
+            return False, False
+        # Compare raw digests - no hex encoding of the freshly derived key
+        return hmac.compare_digest(digest, expected), False
+    
+    return hmac.compare_digest(hash_password(password), str(stored_hash)), True
+
+def set_password(credentials, username, password):
+    """Store a scrypt hash for username, converting legacy string entries to dict format"""
+    user_details = credentials.get(username)
+    
+    if isinstance(user_details, dict):
+        user_details['password'] = hash_password_scrypt(password)
+        user_details['hash_alg'] = 'scrypt'
+    else:
+        credentials[username] = {
+            'password': hash_password_scrypt(password),
+            'hash_alg': 'scrypt',
+            'is_admin': username in ['admin', 'trooper1', 'trooper2', 'commander']
+        }
+
+def _verify(credentials, username, password):
+    """Check password against an already-loaded credentials dict, returns (is_valid, needs_rehash)"""
+    if username not in credentials:
+        return False, False
+    return verify_password(credentials[username], password)
+
 def authenticate_user(username, password, skip_password=False):
     """Authenticate user with username and password"""
-    credentials = load_credentials()
+    credentials = _cached_credentials()
     
     if username not in credentials:
         return False
@@ -30,30 +157,38 @@ def authenticate_user(username, password, skip_password=False):
     if skip_password:
         return True
     
-    hashed_password = hash_password(password)
-    user_details = credentials[username]
+    is_valid, needs_rehash = _verify(credentials, username, password)
     
-    # Handle both old format (string) and new format (dict)
-    if isinstance(user_details, dict):
-        return user_details.get('password') == hashed_password
-    else:
-        # Legacy format - password hash directly stored
-        return user_details == hashed_password
+    # Upgrade legacy SHA256 entries to scrypt on successful login
+    if is_valid and needs_rehash:
+        verified_entry = credentials[username]
+        
+        def upgrade(fresh):
+            # Skip if the account was deleted or its password changed since it was verified
+            if fresh.get(username) != verified_entry:
+                return False
+            set_password(fresh, username, password)
+            return True
+        
+        try:
+            update_credentials(upgrade)
+        except Exception:
+            pass  # Keep the legacy hash and retry on next login
+    
+    return is_valid
 
 def create_user(username, password, preserve_existing=True):
     """Create a new user (for administrative purposes)"""
-    credentials = load_credentials()
-    
-    # CRITICAL: Preserve existing passwords to prevent user lockouts
-    if preserve_existing and username in credentials:
-        print(f"User {username} already exists - preserving existing password")
-        return True  # Don't overwrite existing users
-    
-    credentials[username] = hash_password(password)
-    
-    with open('credentials.json', 'w') as f:
-        json.dump(credentials, f, indent=2)
+    def add(credentials):
+        # CRITICAL: Preserve existing passwords to prevent user lockouts
+        if preserve_existing and username in credentials:
+            print(f"User {username} already exists - preserving existing password")
+            return False  # Don't overwrite existing users
+        
+        set_password(credentials, username, password)
+        return True
     
+    update_credentials(add)
     return True
 
 def safe_initialize_missing_users():
@@ -65,39 +200,30 @@ def safe_initialize_missing_users():
 
 def change_password(username, old_password, new_password):
     """Change user password"""
-    credentials = load_credentials()
-    
-    # Verify current password
-    if not authenticate_user(username, old_password):
-        return False, "Current password is incorrect"
-    
-    if len(new_password) < 6:
-        return False, "New password must be at least 6 characters long"
-    
-    # Update password
-    user_details = credentials[username]
-    
-    # Handle both old format (string) and new format (dict)
-    if isinstance(user_details, dict):
-        credentials[username]['password'] = hash_password(new_password)
-    else:
-        # Legacy format - convert to new format
-        credentials[username] = {
-            'password': hash_password(new_password),
-            'is_admin': username in ['admin', 'trooper1', 'trooper2', 'commander']
-        }
-    
-    # Save updated credentials
-    try:
-        with open('credentials.json', 'w') as f:
-            json.dump(credentials, f, indent=2)
-        return True, "Password changed successfully"
-    except Exception as e:
-        return False, f"Failed to save new password: {str(e)}"
+    with _write_lock:
+        credentials = load_credentials()
+        
+        # Verify against the copy loaded above - authenticate_user would re-read the file and
+        # rehash a legacy entry (an extra scrypt and write) just before it is replaced
+        if not _verify(credentials, username, old_password)[0]:
+            return False, "Current password is incorrect"
+        
+        if len(new_password) < 6:
+            return False, "New password must be at least 6 characters long"
+        
+        # Update password (legacy string entries are converted to the dict format)
+        set_password(credentials, username, new_password)
+        
+        # Save updated credentials
+        try:
+            _write_credentials(credentials)
+            return True, "Password changed successfully"
+        except Exception as e:
+            return False, f"Failed to save new password: {str(e)}"
 
 def get_user_info(username):
     """Get user information"""
-    credentials = load_credentials()
+    credentials = _cached_credentials()
     if username not in credentials:
         return None
     
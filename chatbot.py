@@ -1,35 +1,63 @@
 """
 MSC Safety Bot - AI chatbot using Hugging Face models and real safety data from Google Sheets
 """
+import os
 import streamlit as st
 import pandas as pd
+import numpy as np
 import re
 import json
+import time
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime
-from difflib import SequenceMatcher
+from rate_limiter import allow_action
+
+_WORD_RE = re.compile(r'\b\w+\b')
 
 class MSCSafetyBot:
     def __init__(self):
         self.knowledge_base = []
+        # Inverted index (word -> doc positions) and per-doc arrays, rebuilt with the knowledge base
+        self._postings = {}
+        self._doc_word_counts = np.zeros(0)
+        self._is_pointer = np.zeros(0, dtype=bool)
+        self._is_infographic = np.zeros(0, dtype=bool)
+        self._has_vehicle = np.zeros(0, dtype=bool)
         self.initialized = True
+        self._kb_built_at = 0.0
+        self._kb_ttl = 60  # seconds before the sheets are re-read for a new query
+        self._hf_token = None
+        self._hf_token_loaded = False
+        # Pooled keep-alive connections so repeat API calls skip the TCP/TLS handshake
+        self._session = requests.Session()
+        self._session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
         self.hf_api_url = "https://api-inference.huggingface.co/models/microsoft/DialoGPT-medium"
         self.blip_api_url = "https://api-inference.huggingface.co/models/nlpconnect/vit-gpt2-image-captioning"
         
-    def similarity_score(self, text1, text2):
-        """Calculate similarity between two texts using built-in methods"""
-        return SequenceMatcher(None, text1.lower(), text2.lower()).ratio()
+    def _count_hits(self, words):
+        """Per-document count of how many of words appear in each document (repeats count again)"""
+        hits = [self._postings[word] for word in words if word in self._postings]
+        if not hits:
+            return np.zeros(len(self.knowledge_base))
+        return np.bincount(np.concatenate(hits), minlength=len(self.knowledge_base)).astype(np.float64)
+    
+    def _get_hf_token(self):
+        """Hugging Face token from secrets or environment, looked up once per bot"""
+        if not self._hf_token_loaded:
+            try:
+                self._hf_token = st.secrets["HUGGINGFACE_API_TOKEN"]
+            except:
+                self._hf_token = os.environ.get("HUGGINGFACE_API_TOKEN")
+            self._hf_token_loaded = True
+        
+        return self._hf_token
     
     def query_huggingface(self, prompt, max_length=200):
         """Query Hugging Face API for text generation"""
         try:
             # Check if we have HF token from secrets or environment
-            import os
-            hf_token = None
-            try:
-                hf_token = st.secrets["HUGGINGFACE_API_TOKEN"]
-            except:
-                hf_token = os.environ.get("HUGGINGFACE_API_TOKEN")
+            hf_token = self._get_hf_token()
             
             if not hf_token:
                 return None
@@ -45,7 +73,7 @@ class MSCSafetyBot:
                 }
             }
             
-            response = requests.post(self.hf_api_url, headers=headers, json=payload)
+            response = self._session.post(self.hf_api_url, headers=headers, json=payload)
             
             if response.status_code == 200:
                 result = response.json()
@@ -61,12 +89,7 @@ class MSCSafetyBot:
         """Analyze an image using Salesforce BLIP model"""
         try:
             # Check if we have HF token from secrets or environment
-            import os
-            hf_token = None
-            try:
-                hf_token = st.secrets["HUGGINGFACE_API_TOKEN"]
-            except:
-                hf_token = os.environ.get("HUGGINGFACE_API_TOKEN")
+            hf_token = self._get_hf_token()
             
             if not hf_token:
                 return "No Hugging Face token available"
@@ -74,14 +97,13 @@ class MSCSafetyBot:
             headers = {"Authorization": f"Bearer {hf_token}"}
             
             # Download image and send to BLIP model
-            import requests
             try:
-                image_response = requests.get(image_url, timeout=10)
+                image_response = self._session.get(image_url, timeout=10)
                 if image_response.status_code != 200:
                     return f"Failed to download image (HTTP {image_response.status_code})"
                     
                 # Send image data in binary format for Hugging Face API
-                response = requests.post(
+                response = self._session.post(
                     self.blip_api_url, 
                     headers=headers, 
                     data=image_response.content,
@@ -148,6 +170,23 @@ class MSCSafetyBot:
                 }
                 knowledge_docs.append(doc)
             
+            # Lowercased text and word set per doc, built once here instead of on every query
+            for doc in knowledge_docs:
+                doc['_content_lower'] = doc['content'].lower()
+                doc['_word_set'] = set(_WORD_RE.findall(doc['_content_lower']))
+            
+            postings = {}
+            for idx, doc in enumerate(knowledge_docs):
+                for word in doc['_word_set']:
+                    postings.setdefault(word, []).append(idx)
+            
+            self._postings = {word: np.array(ids, dtype=np.intp) for word, ids in postings.items()}
+            self._doc_word_counts = np.array([len(doc['_word_set']) for doc in knowledge_docs], dtype=np.float64)
+            self._is_pointer = np.array([doc['type'] == 'safety_pointer' for doc in knowledge_docs], dtype=bool)
+            self._is_infographic = np.array([doc['type'] == 'infographic' for doc in knowledge_docs], dtype=bool)
+            self._has_vehicle = np.array([
+                any(term in doc['_content_lower'] for term in ['terrex', 'belrex']) for doc in knowledge_docs
+            ], dtype=bool)
             self.knowledge_base = knowledge_docs
             return len(knowledge_docs)
             
@@ -162,47 +201,37 @@ class MSCSafetyBot:
         
         try:
             query_lower = query.lower()
-            query_keywords = re.findall(r'\b\w+\b', query_lower)
+            query_keywords = _WORD_RE.findall(query_lower)
+            query_words = set(query_keywords)
             
-            doc_scores = []
+            # Keyword score counts every query keyword the doc contains, as the per-doc loop did
+            keyword_scores = self._count_hits(query_keywords)
             
-            for i, doc in enumerate(self.knowledge_base):
-                doc_text = doc['content'].lower()
-                
-                # Calculate keyword matching score
-                keyword_score = 0
-                for keyword in query_keywords:
-                    if keyword in doc_text:
-                        keyword_score += 1
-                
-                # Calculate text similarity score
-                similarity_score = self.similarity_score(query, doc['content'])
-                
-                # Boost score for specific terms
-                boost_score = 0
-                if any(term in query_lower for term in ['terrex', 'belrex']):
-                    if any(term in doc_text for term in ['terrex', 'belrex']):
-                        boost_score += 0.3
-                
-                if any(term in query_lower for term in ['safety', 'pointer', 'recommendation']):
-                    if doc['type'] == 'safety_pointer':
-                        boost_score += 0.2
-                
-                if any(term in query_lower for term in ['infographic', 'image', 'visual']):
-                    if doc['type'] == 'infographic':
-                        boost_score += 0.2
-                
-                final_score = (keyword_score * 0.4) + (similarity_score * 0.4) + boost_score
-                
-                if final_score > 0.1:  # Minimum relevance threshold
-                    doc_scores.append({
-                        'doc': doc,
-                        'similarity': final_score
-                    })
+            # Jaccard similarity between the query and doc word sets
+            overlap = self._count_hits(query_words)
+            union = len(query_words) + self._doc_word_counts - overlap
+            similarity_scores = np.divide(overlap, union, out=np.zeros_like(overlap), where=union > 0)
+            
+            # Boost score for specific terms
+            boost_scores = np.zeros(len(self.knowledge_base))
+            if any(term in query_lower for term in ['terrex', 'belrex']):
+                boost_scores += 0.3 * self._has_vehicle
+            
+            if any(term in query_lower for term in ['safety', 'pointer', 'recommendation']):
+                boost_scores += 0.2 * self._is_pointer
+            
+            if any(term in query_lower for term in ['infographic', 'image', 'visual']):
+                boost_scores += 0.2 * self._is_infographic
             
-            # Sort by score and return top k
-            doc_scores.sort(key=lambda x: x['similarity'], reverse=True)
-            return doc_scores[:top_k]
+            final_scores = (keyword_scores * 0.4) + (similarity_scores * 0.4) + boost_scores
+            
+            # Stable sort keeps knowledge-base order on ties; below-threshold docs sort after the rest
+            ranked = np.argsort(-final_scores, kind='stable')[:top_k]
+            return [
+                {'doc': self.knowledge_base[idx], 'similarity': float(final_scores[idx])}
+                for idx in ranked
+                if final_scores[idx] > 0.1  # Minimum relevance threshold
+            ]
             
         except Exception as e:
             st.error(f"Error retrieving documents: {str(e)}")
@@ -304,10 +333,19 @@ Provide a helpful response focusing on the safety recommendations and observatio
             
             return "\n".join(response_parts)
     
+    def refresh_knowledge_base(self, sheets_manager, force_refresh=False):
+        """Rebuild the knowledge base only when it is empty, older than the TTL or force_refresh is set"""
+        now = time.monotonic()
+        if force_refresh or not self.knowledge_base or now - self._kb_built_at > self._kb_ttl:
+            if self.prepare_knowledge_base(sheets_manager):
+                self._kb_built_at = now
+        
+        return len(self.knowledge_base)
+    
     def chat(self, query, sheets_manager):
         """Main chat function"""
-        # Refresh knowledge base
-        doc_count = self.prepare_knowledge_base(sheets_manager)
+        # Refresh knowledge base when stale
+        doc_count = self.refresh_knowledge_base(sheets_manager)
         
         if doc_count == 0:
             return "I don't have any safety data available yet. Please submit some safety pointers or infographics first!"
@@ -325,23 +363,16 @@ def render_chatbot_interface(sheets_manager):
     st.markdown("### 🤖 MSC SAFETY BOT")
     st.markdown("*AI-powered assistant that searches through submitted safety content and provides intelligent responses.*")
     
-    # Check if Hugging Face token is available
-    import os
-    hf_token = None
-    try:
-        hf_token = st.secrets["HUGGINGFACE_API_TOKEN"]
-    except:
-        hf_token = os.environ.get("HUGGINGFACE_API_TOKEN")
+    # Initialize chatbot
+    if 'safety_bot' not in st.session_state:
+        st.session_state.safety_bot = MSCSafetyBot()
     
-    if hf_token:
+    # Check if Hugging Face token is available
+    if st.session_state.safety_bot._get_hf_token():
         st.success("🚀 AI Enhancement: Powered by Hugging Face")
     else:
         st.info("💡 Note: Add HUGGINGFACE_API_TOKEN to secrets for enhanced AI responses")
     
-    # Initialize chatbot
-    if 'safety_bot' not in st.session_state:
-        st.session_state.safety_bot = MSCSafetyBot()
-    
     # Initialize chat history
     if 'chat_history' not in st.session_state:
         st.session_state.chat_history = []
@@ -362,7 +393,10 @@ def render_chatbot_interface(sheets_manager):
     col1, col2 = st.columns([1, 3])
     with col1:
         if st.button("🔍 Ask", type="primary"):
-            if query.strip():
+            # Each question may hit the sheets and the Hugging Face API, so it counts against the limiter
+            if query.strip() and not allow_action(st.session_state.get('username', 'unknown'), st.session_state.get('session_token')):
+                st.error("🚫 Too many requests. Please wait a few seconds and try again.")
+            elif query.strip():
                 with st.spinner("Searching safety database..."):
                     response = st.session_state.safety_bot.chat(query, sheets_manager)
                     
@@ -375,10 +409,8 @@ def render_chatbot_interface(sheets_manager):
     
     with col2:
         if st.button("🔄 Refresh Data"):
-            # Clear cached data
-            if hasattr(st.session_state.safety_bot, 'knowledge_base'):
-                st.session_state.safety_bot.knowledge_base = []
-                st.session_state.safety_bot.embeddings = None
+            # Re-read the sheets now instead of waiting for the TTL
+            st.session_state.safety_bot.refresh_knowledge_base(sheets_manager, force_refresh=True)
             st.success("Data refreshed!")
     
     # Display chat history
@@ -1,5 +1,8 @@
 # App optimization utilities
 import streamlit as st
+import numpy as np
+import pandas as pd
+import pyarrow as pa
 import time
 from functools import wraps
 
@@ -77,6 +80,14 @@ def performance_timer(func):
         return result
     return wrapper
 
+# Large table rendering
+def display_dataframe_quickly(df, key, max_rows=500, **kwargs):
+    """Render at most max_rows rows, with a slider to page through larger tables"""
+    if len(df) > max_rows:
+        start = st.slider("Start row", 0, len(df) - max_rows, key=key)
+        df = df.iloc[start:start + max_rows]
+    st.dataframe(df, **kwargs)
+
 # Batch processing utility
 def batch_process_data(data_list, batch_size=50):
     """Process data in batches to improve performance"""
@@ -86,11 +97,15 @@ def batch_process_data(data_list, batch_size=50):
 # Memory optimization
 def optimize_dataframe(df):
     """Optimize DataFrame memory usage"""
-    import pandas as pd
-    
     if df.empty:
         return df
     
+    # Mixed-type object columns (e.g. day counts mixed with 'N/A') break Arrow
+    # serialization - store them as Arrow strings once instead of casting per render
+    for col in df.select_dtypes(include=['object']).columns:
+        if df[col].map(type).nunique() > 1:
+            df[col] = df[col].astype(str).astype(pd.ArrowDtype(pa.string()))
+    
     # Convert object columns to category where appropriate
     for col in df.select_dtypes(include=['object']).columns:
         if df[col].nunique() / len(df) < 0.5:  # If less than 50% unique values
@@ -103,4 +118,14 @@ def optimize_dataframe(df):
     for col in df.select_dtypes(include=['float64']).columns:
         df[col] = pd.to_numeric(df[col], downcast='float')
     
-    return df
\ No newline at end of file
+    return df
+
+def top_k_rows(df, col, k=8):
+    """Return the k rows with the largest values in col, largest first (O(N) selection)"""
+    values = df[col].to_numpy(dtype='float64', na_value=-np.inf)
+    if len(values) <= k:
+        idx = np.argsort(-values, kind='stable')
+    else:
+        part = np.argpartition(-values, k)[:k]
+        idx = part[np.argsort(-values[part], kind='stable')]
+    return df.iloc[idx]
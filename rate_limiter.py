@@ -0,0 +1,116 @@
+# Rate limiting for expensive actions (Sheets writes, chatbot queries), shared by every worker
+#
+# Uses a Redis rolling-window log (one atomic Lua call per request) when REDIS_URL is set
+# and the redis package is installed, otherwise a process-local log guarded by a lock.
+import os
+import threading
+import time
+from collections import deque
+
+try:
+    import redis  # Optional - only needed when running several app processes
+except ImportError:
+    redis = None
+
+from redis_circuit import RedisCircuit
+
+# Only expensive actions are counted - not plain reruns - so 30 in any 30 second window
+# is far above what a person clicking submit buttons reaches
+WINDOW_SECONDS = 30
+WINDOW_LIMIT = 30
+
+# KEYS[1] = window key, ARGV = now_us, window_us, limit, member
+# Only KEYS[1] is touched, so the script is single-slot and safe under Redis Cluster
+ROLLING_WINDOW_LUA = """
+local now_us = tonumber(ARGV[1])
+local window_us = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+
+redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, now_us - window_us)
+if redis.call('ZCARD', KEYS[1]) >= limit then
+    return 0
+end
+
+redis.call('ZADD', KEYS[1], now_us, ARGV[4])
+redis.call('PEXPIRE', KEYS[1], math.ceil(window_us / 1000))
+return 1
+"""
+
+# Idle user windows are swept from the local store at most this often
+LOCAL_SWEEP_SECONDS = 60
+
+_redis_script = None
+_redis_lock = threading.Lock()
+_redis_circuit = RedisCircuit("rate limiter")
+
+_local_windows = {}
+_local_lock = threading.Lock()
+_last_sweep = 0.0
+
+def _get_redis_script():
+    """Connect and SCRIPT LOAD once per process; returns None when Redis is not configured"""
+    global _redis_script
+    
+    if _redis_script is None and redis is not None and os.getenv('REDIS_URL'):
+        with _redis_lock:
+            if _redis_script is None:
+                client = redis.Redis.from_url(os.environ['REDIS_URL'], socket_timeout=0.5)
+                # register_script caches the SHA and calls EVALSHA, reloading only on NOSCRIPT
+                _redis_script = client.register_script(ROLLING_WINDOW_LUA)
+    
+    return _redis_script
+
+def _sweep_local_windows(now, window_seconds):
+    """Drop windows whose newest request has aged out - caller must hold _local_lock"""
+    global _last_sweep
+    
+    _last_sweep = now
+    idle = [key for key, requests in _local_windows.items() if not requests or requests[-1] <= now - window_seconds]
+    for key in idle:
+        del _local_windows[key]
+
+def _local_allow(key, now, window_seconds, limit):
+    """Process-local rolling window with the same semantics as the Lua script"""
+    with _local_lock:
+        if now - _last_sweep >= LOCAL_SWEEP_SECONDS:
+            _sweep_local_windows(now, window_seconds)
+        
+        requests = _local_windows.setdefault(key, deque())
+        
+        # Timestamps are appended in order, so expired ones are always at the left
+        while requests and requests[0] <= now - window_seconds:
+            requests.popleft()
+        
+        if len(requests) >= limit:
+            return False
+        
+        requests.append(now)
+    
+    return True
+
+def allow_request(user_id, window_seconds=WINDOW_SECONDS, limit=WINDOW_LIMIT):
+    """Record a request for user_id and return whether it fits in the rolling window"""
+    # Hash tag keeps each user's keys on one Redis Cluster slot while users spread across shards
+    key = f"{{u:{user_id}}}:rw"
+    now = time.time()
+    
+    # Skip Redis entirely while a recent failure's cooldown runs - no per-rerun socket timeout
+    if _redis_circuit.available():
+        try:
+            script = _get_redis_script()
+            if script is not None:
+                now_us = int(now * 1_000_000)
+                # Random suffix keeps members unique when two requests share a timestamp
+                member = f"{now_us}-{os.urandom(4).hex()}"
+                allowed = bool(script(keys=[key], args=[now_us, int(window_seconds * 1_000_000), limit, member]))
+                _redis_circuit.succeeded()
+                return allowed
+        except Exception as e:
+            _redis_circuit.failed(e)
+    
+    return _local_allow(key, now, window_seconds, limit)
+
+def allow_action(username, session_id, window_seconds=WINDOW_SECONDS, limit=WINDOW_LIMIT):
+    """Record an expensive action for one login session of username and return whether it is allowed"""
+    # Scoped to the session so one busy tab or device can't lock the account out everywhere
+    return allow_request(f"{username}:{session_id}", window_seconds, limit)
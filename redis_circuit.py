@@ -0,0 +1,46 @@
+# Circuit breaker for the optional Redis backends
+#
+# After a Redis call fails, callers skip Redis for a cooldown and use their local fallback,
+# so an outage costs one socket timeout per cooldown instead of one per rerun.
+import logging
+import threading
+import time
+
+# Seconds to stay on the local fallback after a Redis failure before trying again
+REDIS_RETRY_SECONDS = 30
+
+logger = logging.getLogger(__name__)
+
+class RedisCircuit:
+    def __init__(self, name, retry_seconds=REDIS_RETRY_SECONDS):
+        self.name = name
+        self.retry_seconds = retry_seconds
+        self._retry_at = 0.0
+        self._down = False
+        self._lock = threading.Lock()
+    
+    def available(self):
+        """False while a recent failure's cooldown is still running"""
+        return time.monotonic() >= self._retry_at
+    
+    def failed(self, error):
+        """Open the circuit for the cooldown; logs only the first failure of an outage"""
+        with self._lock:
+            self._retry_at = time.monotonic() + self.retry_seconds
+            first_failure = not self._down
+            self._down = True
+        
+        if first_failure:
+            logger.warning("Redis %s unavailable, using local fallback: %s", self.name, error)
+    
+    def succeeded(self):
+        """Close the circuit after a successful call, logging recovery from an outage"""
+        if not self._down:
+            return
+        
+        with self._lock:
+            recovered = self._down
+            self._down = False
+        
+        if recovered:
+            logger.info("Redis %s reachable again", self.name)
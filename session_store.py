@@ -0,0 +1,176 @@
+# Server-side login sessions keyed by an opaque browser token
+#
+# Stored in Redis with a TTL when REDIS_URL is set and the redis package is installed,
+# otherwise in a process-local dict (sessions then last until the process restarts).
+import json
+import os
+import secrets
+import threading
+import time
+
+try:
+    import redis  # Optional - shares sessions between app processes
+except ImportError:
+    redis = None
+
+try:
+    import ormsgpack  # Optional - compact, faster session records
+except ImportError:
+    ormsgpack = None
+
+from redis_circuit import RedisCircuit
+
+SESSION_TTL_SECONDS = 7200  # 2 hours, matching the browser-side check
+
+# KEYS[1] = session key, ARGV[1] = new absolute expiry (unix seconds)
+# Look up and extend in one atomic round trip - no GET/EXPIRE race
+REFRESH_SESSION_LUA = """
+local record = redis.call('GET', KEYS[1])
+if not record then
+    return false
+end
+redis.call('EXPIREAT', KEYS[1], ARGV[1])
+return record
+"""
+
+# Expired local sessions are swept at most this often
+LOCAL_SWEEP_SECONDS = 60
+
+_redis_client = None
+_redis_refresh_script = None
+_redis_lock = threading.Lock()
+_redis_circuit = RedisCircuit("session store")
+
+_local_sessions = {}
+_local_lock = threading.Lock()
+_last_sweep = 0.0
+
+def _pack_session(record):
+    """Serialize a session record - msgpack when available, JSON otherwise"""
+    if ormsgpack:
+        return ormsgpack.packb(record)
+    return json.dumps(record)
+
+def _unpack_session(raw):
+    """Deserialize a record written by either format (JSON records always start with '{')"""
+    if raw[:1] == b'{' or not ormsgpack:
+        return json.loads(raw)
+    return ormsgpack.unpackb(raw)
+
+def _sweep_local_sessions(now):
+    """Drop expired local sessions nobody looked up again - caller must hold _local_lock"""
+    global _last_sweep
+    
+    _last_sweep = now
+    expired = [token for token, (_, expires_at) in _local_sessions.items() if now >= expires_at]
+    for token in expired:
+        del _local_sessions[token]
+
+def _get_redis():
+    """Connect once per process; returns None when Redis is not configured or in a failure cooldown"""
+    global _redis_client, _redis_refresh_script
+    
+    if not _redis_circuit.available():
+        return None
+    
+    if _redis_client is None and redis is not None and os.getenv('REDIS_URL'):
+        with _redis_lock:
+            if _redis_client is None:
+                client = redis.Redis.from_url(os.environ['REDIS_URL'], socket_timeout=0.5)
+                _redis_refresh_script = client.register_script(REFRESH_SESSION_LUA)
+                _redis_client = client
+    
+    return _redis_client
+
+def create_session(username):
+    """Mint an opaque token for username, store the session record and return (token, expires_at)"""
+    token = secrets.token_urlsafe(16)
+    login_time = time.time()
+    # Absolute expiry shared with the browser so both sides evict at the same instant
+    expires_at = int(login_time) + SESSION_TTL_SECONDS
+    
+    try:
+        client = _get_redis()
+        if client is not None:
+            client.set(f"sess:{token}", _pack_session({"u": username, "t": login_time}), exat=expires_at)
+            _redis_circuit.succeeded()
+            return token, expires_at
+    except Exception as e:
+        _redis_circuit.failed(e)
+    
+    with _local_lock:
+        if login_time - _last_sweep >= LOCAL_SWEEP_SECONDS:
+            _sweep_local_sessions(login_time)
+        _local_sessions[token] = (username, expires_at)
+    return token, expires_at
+
+def get_session_user(token):
+    """Return the username for a live session token, or None"""
+    if not token:
+        return None
+    
+    try:
+        client = _get_redis()
+        if client is not None:
+            raw = client.get(f"sess:{token}")
+            _redis_circuit.succeeded()
+            return _unpack_session(raw)["u"] if raw else None
+    except Exception as e:
+        _redis_circuit.failed(e)
+    
+    with _local_lock:
+        session = _local_sessions.get(token)
+        if session is None:
+            return None
+        
+        username, expires_at = session
+        if time.time() >= expires_at:
+            del _local_sessions[token]
+            return None
+    
+    return username
+
+def refresh_session(token):
+    """Look up a session and slide its expiry forward; returns (username, expires_at) or (None, None)"""
+    if not token:
+        return None, None
+    
+    expires_at = int(time.time()) + SESSION_TTL_SECONDS
+    
+    try:
+        if _get_redis() is not None:
+            raw = _redis_refresh_script(keys=[f"sess:{token}"], args=[expires_at])
+            _redis_circuit.succeeded()
+            return (_unpack_session(raw)["u"], expires_at) if raw else (None, None)
+    except Exception as e:
+        _redis_circuit.failed(e)
+    
+    with _local_lock:
+        session = _local_sessions.get(token)
+        if session is None:
+            return None, None
+        
+        username, current_expiry = session
+        if time.time() >= current_expiry:
+            del _local_sessions[token]
+            return None, None
+        
+        _local_sessions[token] = (username, expires_at)
+    
+    return username, expires_at
+
+def delete_session(token):
+    """Invalidate a session token (logout)"""
+    if not token:
+        return
+    
+    try:
+        client = _get_redis()
+        if client is not None:
+            client.delete(f"sess:{token}")
+            _redis_circuit.succeeded()
+    except Exception as e:
+        _redis_circuit.failed(e)
+    
+    with _local_lock:
+        _local_sessions.pop(token, None)
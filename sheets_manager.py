@@ -5,9 +5,115 @@ from datetime import datetime, timedelta
 import os
 import json
 import streamlit as st
+import threading
+import atexit
+import weakref
+from collections import Counter
 from functools import lru_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 # Removed api_optimizer import to fix compatibility
 
+# Mileage log write batching - queued rows are flushed with one append_rows call
+MILEAGE_FLUSH_ROWS = 20  # Flush immediately once this many rows are queued
+MILEAGE_FLUSH_SECONDS = 3  # Otherwise flush this long after the first queued row
+MILEAGE_RETRY_MAX_SECONDS = 300  # Failed flushes retry with doubling delays up to this cap
+
+MILEAGE_HEADERS = ['Username', 'Date_of_Drive', 'Vehicle_No_MID', 'Initial_Mileage_KM', 'Final_Mileage_KM', 'Distance_Driven_KM', 'Vehicle_Type', 'Timestamp']
+
+# Every live manager, so queued rows are written once at interpreter exit without
+# atexit holding a reference to instances dropped by st.cache_resource.clear()
+_live_managers = weakref.WeakSet()
+
+def _flush_all_managers():
+    """atexit hook - write whatever is still queued on each live manager"""
+    for manager in list(_live_managers):
+        manager.flush_mileage_logs()
+
+atexit.register(_flush_all_managers)
+
+# Background flush errors per owner, kept at module level so failures from a manager that
+# st.cache_resource.clear() has since replaced still reach the next pop_flush_errors call
+_flush_errors = {}
+_flush_errors_lock = threading.Lock()
+
+def _records_from_values(values, headers=None):
+    """Build record dicts from raw sheet values - uses the header row (later duplicates win) unless headers are given"""
+    if len(values) < 2:
+        return []
+    
+    records = []
+    if headers is None:
+        headers = values[0]
+        for row in values[1:]:
+            record = {}
+            for i, header in enumerate(headers):
+                if i < len(row):
+                    record[header] = row[i]
+            records.append(record)
+    else:
+        for row in values[1:]:
+            records.append({header: row[i] if i < len(row) else '' for i, header in enumerate(headers)})
+    return records
+
+def _read_records(worksheet):
+    """get_all_records with a raw-values fallback for sheets with duplicate headers"""
+    try:
+        return worksheet.get_all_records()
+    except:
+        # Handle duplicate headers by using raw values
+        return _records_from_values(worksheet.get_all_values())
+
+def _find_user_record(records, username):
+    """Return the first record for username, or None"""
+    for record in records:
+        if record.get('Username') == username:
+            return record
+    return None
+
+def _to_float(value):
+    """Sheet cell to float - blank and non-numeric cells count as 0"""
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+def _find_tracker_record(records, username):
+    """Return the user's tracker record with its numeric fields already coerced, or None"""
+    record = _find_user_record(records, username)
+    if record is not None:
+        record['Distance in Last 3 Months'] = _to_float(record.get('Distance in Last 3 Months'))
+    return record
+
+def _user_mileage_frame(records, username):
+    """Filter Mileage_Logs records to one user with parsed dates and numeric distances"""
+    if not records:
+        return pd.DataFrame()
+    
+    # Convert to DataFrame
+    df = pd.DataFrame(records)
+    
+    # Filter for specific user
+    user_data = df[df['Username'] == username].copy()
+    
+    if user_data.empty:
+        return pd.DataFrame()
+    
+    # Convert date column to datetime
+    user_data['Date_of_Drive'] = pd.to_datetime(user_data['Date_of_Drive'], errors='coerce')
+    
+    # Convert numeric columns to float
+    numeric_columns = ['Initial_Mileage_KM', 'Final_Mileage_KM', 'Distance_Driven_KM']
+    for col in numeric_columns:
+        if col in user_data.columns:
+            user_data[col] = pd.to_numeric(user_data[col], errors='coerce')
+    
+    # Remove rows with invalid dates
+    user_data = user_data.dropna(subset=['Date_of_Drive'])
+    
+    # Sort by date
+    return user_data.sort_values('Date_of_Drive')
+
 class SheetsManager:
     def __init__(self):
         """Initialize Google Sheets connection"""
@@ -15,6 +121,16 @@ class SheetsManager:
         self.connect_to_sheets()
         self.setup_worksheets()
         self._cache_timeout = 1800  # 30 minutes cache timeout
+        
+        # Pending (owner, row) pairs, shared by all sessions using this cached instance.
+        # owner identifies the submitting session so flush errors are reported only to it
+        self._pending_logs = []
+        self._pending_lock = threading.Lock()
+        self._flush_timer = None
+        self._flush_failures = 0
+        # Bumped after each successful flush - views keyed on it rebuild once the rows are in the sheet
+        self.data_version = 0
+        _live_managers.add(self)
     
     def setup_credentials(self):
         """Setup Google Sheets API credentials"""
@@ -42,6 +158,16 @@ class SheetsManager:
         try:
             self.client = gspread.authorize(self.creds)
             
+            # Reuse one pooled keep-alive HTTPS session for every Sheets call, with
+            # backoff on 429/5xx (urllib3 does not retry POSTs, so appends are never duplicated)
+            session = self.client.http_client.session
+            session.headers['Connection'] = 'keep-alive'
+            session.mount('https://', HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=16,
+                max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False)
+            ))
+            
             # Get spreadsheet ID from environment or use default
             spreadsheet_id = os.getenv('GOOGLE_SHEET_ID', '1jHRQuVdQKISnjDov6EwaSRhBlvpXDodLnyXOC9BDIMQ')
             
@@ -110,10 +236,28 @@ class SheetsManager:
     @st.cache_data(ttl=900, show_spinner=False)  # 15 minute cache for qualifications (balanced performance)
     def check_user_qualifications(_self, username):
         """Check if user is qualified for Terrex and/or Belrex based on presence in tracker sheets"""
+        terrex_records, belrex_records = [], []
+        
+        # Built-in accounts don't need the tracker sheets
+        if username not in ['admin', 'trooper1', 'trooper2', 'commander']:
+            # If sheets don't exist or error occurs, assume no qualifications
+            try:
+                terrex_records = _read_records(_self.terrex_worksheet)
+            except Exception:
+                pass
+            try:
+                belrex_records = _read_records(_self.belrex_worksheet)
+            except Exception:
+                pass
+        
+        return _self._qualifications_from_records(username, terrex_records, belrex_records)
+    
+    def _qualifications_from_records(self, username, terrex_records, belrex_records):
+        """Build the qualifications dict for username from already-fetched tracker records"""
         qualifications = {'terrex': False, 'belrex': False, 'full_name': '', 'rank': '', 'is_admin': False}
         
         # Check if user is admin and commander from User Management sheet
-        user_management = _self.get_user_management_info(username)
+        user_management = self.get_user_management_info(username)
         is_admin = user_management.get('is_admin', False)
         is_commander = user_management.get('is_commander', False)
         qualifications['is_admin'] = is_admin
@@ -135,78 +279,59 @@ class SheetsManager:
             qualifications['rank'] = 'CDR' if username == 'commander' else 'TPR'
             return qualifications
         
+        for vehicle, records in (('terrex', terrex_records), ('belrex', belrex_records)):
+            record = _find_user_record(records, username)
+            if record is None:
+                continue
+            
+            # Get full name and rank from the first sheet that has them
+            if not qualifications['full_name']:
+                qualifications['full_name'] = record.get('Name', '')
+                qualifications['rank'] = record.get('Rank', '')
+            
+            # Check if qualified (has qualification date and qualification)
+            qualification = str(record.get('Qualification', '')).strip()
+            qual_date = str(record.get('Qualification Date', '')).strip()
+            
+            if qualification and qual_date:
+                qualifications[vehicle] = True
+        
+        return qualifications
+    
+    @st.cache_data(ttl=60, show_spinner=False)  # Same lifetime as get_user_data
+    def get_currency_bundle(_self, username):
+        """Get qualifications, tracker data and mileage logs for one user with a single batchGet"""
         try:
-            # Check Terrex qualifications
-            try:
-                terrex_records = _self.terrex_worksheet.get_all_records()
-            except:
-                # Handle duplicate headers by using raw values
-                terrex_values = _self.terrex_worksheet.get_all_values()
-                terrex_records = []
-                if len(terrex_values) > 1:
-                    headers = terrex_values[0]
-                    for row in terrex_values[1:]:
-                        record = {}
-                        for i, header in enumerate(headers):
-                            if i < len(row):
-                                record[header] = row[i]
-                        terrex_records.append(record)
-            
-            # Check if user exists and has qualification data
-            for record in terrex_records:
-                if record.get('Username') == username:
-                    # Get full name and rank
-                    qualifications['full_name'] = record.get('Name', '')
-                    qualifications['rank'] = record.get('Rank', '')
-                    
-                    # Check if qualified (has qualification date and qualification)
-                    qualification = record.get('Qualification', '').strip()
-                    qual_date = record.get('Qualification Date', '').strip()
-                    
-                    if qualification and qual_date:
-                        qualifications['terrex'] = True
-                    break
-            
-            # Check Belrex qualifications
-            try:
-                belrex_records = _self.belrex_worksheet.get_all_records()
-            except:
-                # Handle duplicate headers by using raw values
-                belrex_values = _self.belrex_worksheet.get_all_values()
-                belrex_records = []
-                if len(belrex_values) > 1:
-                    headers = belrex_values[0]
-                    for row in belrex_values[1:]:
-                        record = {}
-                        for i, header in enumerate(headers):
-                            if i < len(row):
-                                record[header] = row[i]
-                        belrex_records.append(record)
-            
-            # Check if user exists and has qualification data
-            for record in belrex_records:
-                if record.get('Username') == username:
-                    # If we don't have name yet, get it from Belrex sheet
-                    if not qualifications['full_name']:
-                        qualifications['full_name'] = record.get('Name', '')
-                        qualifications['rank'] = record.get('Rank', '')
-                    
-                    # Check if qualified (has qualification date and qualification)
-                    qualification = record.get('Qualification', '').strip()
-                    qual_date = record.get('Qualification Date', '').strip()
-                    
-                    if qualification and qual_date:
-                        qualifications['belrex'] = True
-                    break
-                
+            response = _self.spreadsheet.values_batch_get([
+                gspread.utils.absolute_range_name(_self.terrex_worksheet.title),
+                gspread.utils.absolute_range_name(_self.belrex_worksheet.title),
+                gspread.utils.absolute_range_name(_self.mileage_worksheet.title)
+            ])
         except Exception as e:
-            # If sheets don't exist or error occurs, assume no qualifications
-            pass
+            raise Exception(f"Failed to get currency data: {str(e)}")
         
-        return qualifications
+        value_ranges = response.get('valueRanges', [])
+        terrex_values, belrex_values, mileage_values = [
+            value_ranges[i].get('values', []) if i < len(value_ranges) else [] for i in range(3)
+        ]
+        
+        terrex_records = _records_from_values(terrex_values)
+        belrex_records = _records_from_values(belrex_values)
+        
+        qualifications = _self._qualifications_from_records(username, terrex_records, belrex_records)
+        tracker_data = {
+            'terrex': _find_tracker_record(terrex_records, username),
+            'belrex': _find_tracker_record(belrex_records, username)
+        }
+        user_data = _user_mileage_frame(_records_from_values(mileage_values, MILEAGE_HEADERS), username)
+        
+        return qualifications, tracker_data, user_data
     
     def clear_caches(self):
         """Clear all cached data to force refresh"""
+        # Write any queued mileage rows first so the refresh sees them
+        self.flush_mileage_logs()
+        
         # Clear Streamlit cache for this instance
         if hasattr(st, 'cache_data'):
             st.cache_data.clear()
@@ -256,8 +381,8 @@ class SheetsManager:
             print(f"Error getting safety pointers: {e}")
             return []
     
-    def add_mileage_log(self, log_data):
-        """Add a new mileage log entry"""
+    def add_mileage_log(self, log_data, owner=None):
+        """Queue a new mileage log entry - rows are written in batches by flush_mileage_logs"""
         try:
             # Prepare row data for Mileage_Logs
             row = [
@@ -271,42 +396,85 @@ class SheetsManager:
                 log_data['Timestamp']
             ]
             
-            # Only append to Mileage_Logs worksheet - do not modify tracker sheets
-            self.mileage_worksheet.append_row(row)
+            with self._pending_lock:
+                self._pending_logs.append((owner, row))
+                # While the sheet is failing, leave retries to the backoff timer instead of blocking this submit
+                flush_now = len(self._pending_logs) >= MILEAGE_FLUSH_ROWS and not self._flush_failures
+                if not flush_now and self._flush_timer is None:
+                    self._schedule_flush(MILEAGE_FLUSH_SECONDS)
             
-            # Clear relevant caches to ensure fresh data after new entry
-            self._clear_related_caches()
+            if flush_now:
+                self.flush_mileage_logs()
             
             return True
             
         except Exception as e:
             raise Exception(f"Failed to add mileage log: {str(e)}")
     
+    def _schedule_flush(self, delay):
+        """Start the background flush timer - caller must hold _pending_lock"""
+        self._flush_timer = threading.Timer(delay, self.flush_mileage_logs)
+        self._flush_timer.daemon = True
+        self._flush_timer.start()
+    
+    def flush_mileage_logs(self):
+        """Write all queued mileage rows to Mileage_Logs in a single append_rows call"""
+        with self._pending_lock:
+            pending = self._pending_logs
+            self._pending_logs = []
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+        
+        if not pending:
+            return True
+        
+        try:
+            # Only append to Mileage_Logs worksheet - do not modify tracker sheets.
+            # RAW stores the values as sent, skipping Sheets' user-input parsing
+            self.mileage_worksheet.append_rows([row for _, row in pending], value_input_option='RAW')
+        except Exception as e:
+            # Re-queue the rows and retry on a timer, doubling the delay after each failed attempt
+            with _flush_errors_lock:
+                for owner, count in Counter(owner for owner, _ in pending).items():
+                    _flush_errors.setdefault(owner, []).append(f"Failed to save {count} mileage log(s): {str(e)}")
+            
+            with self._pending_lock:
+                self._pending_logs[:0] = pending
+                self._flush_failures += 1
+                if self._flush_timer is None:
+                    delay = min(MILEAGE_FLUSH_SECONDS * 2 ** self._flush_failures, MILEAGE_RETRY_MAX_SECONDS)
+                    self._schedule_flush(delay)
+            return False
+        
+        with self._pending_lock:
+            self._flush_failures = 0
+        
+        # Clear relevant caches to ensure fresh data after new entries
+        self._clear_related_caches()
+        # Only after the caches are cleared, so a view rebuilt for the new version reads fresh data
+        with self._pending_lock:
+            self.data_version += 1
+        return True
+    
+    def pop_flush_errors(self, owner):
+        """Return and clear background flush errors for rows queued by owner"""
+        with _flush_errors_lock:
+            return _flush_errors.pop(owner, [])
+    
     def _clear_related_caches(self):
         """Clear caches that should refresh after new mileage entries"""
+        # Runs on the flush timer thread with no script run context - only touch
+        # the shared cache_data functions here, never st.session_state
         try:
-            # Clear Streamlit caches for functions that depend on mileage data
-            if hasattr(st, 'cache_data'):
-                # Clear specific cached functions
-                self.get_all_personnel_status.clear()
-                self.calculate_3_month_distance.clear()
-                self.calculate_expiry_date.clear()
-                self.get_user_tracker_data.clear()
-            
-            # Clear session state caches
-            cache_keys_to_clear = [
-                'name_lookup_cache',
-                'personnel_status_cache', 
-                'team_dashboard_cache',
-                'currency_status_cache'
-            ]
-            
-            for key in cache_keys_to_clear:
-                if key in st.session_state:
-                    del st.session_state[key]
-                    
+            self.get_all_personnel_status.clear()
+            self.calculate_3_month_distance.clear()
+            self.calculate_expiry_date.clear()
+            self.get_user_tracker_data.clear()
+            self.get_user_data.clear()
+            self.get_currency_bundle.clear()
         except Exception as e:
-            pass  # Fail silently for cache clearing
+            print(f"Error clearing mileage caches: {e}")
     
     def get_safety_infographics(self):
         """Get safety infographics submissions sorted by newest first"""
@@ -481,152 +649,64 @@ class SheetsManager:
         except Exception as e:
             return "N/A"
     
-    def get_user_data(self, username):
+    @st.cache_data(ttl=60, show_spinner=False)  # 1 minute cache - absorbs reruns while browsing the same view
+    def get_user_data(_self, username):
         """Get all mileage data for a specific user"""
         try:
             # Get all records from Mileage_Logs with expected headers to handle duplicates
-            expected_headers = ['Username', 'Date_of_Drive', 'Vehicle_No_MID', 'Initial_Mileage_KM', 'Final_Mileage_KM', 'Distance_Driven_KM', 'Vehicle_Type', 'Timestamp']
-            
             try:
-                records = self.mileage_worksheet.get_all_records(expected_headers=expected_headers)
+                records = _self.mileage_worksheet.get_all_records(expected_headers=MILEAGE_HEADERS)
             except:
                 # Fallback: get all values and create records manually
-                all_values = self.mileage_worksheet.get_all_values()
-                if len(all_values) < 2:
-                    return pd.DataFrame()
-                
-                headers = all_values[0]
-                records = []
-                for row in all_values[1:]:
-                    record = {}
-                    for i, header in enumerate(expected_headers):
-                        if i < len(row):
-                            record[header] = row[i]
-                        else:
-                            record[header] = ''
-                    records.append(record)
-            
-            if not records:
-                return pd.DataFrame()
-            
-            # Convert to DataFrame
-            df = pd.DataFrame(records)
-            
-            # Filter for specific user
-            user_data = df[df['Username'] == username].copy()
-            
-            if user_data.empty:
-                return pd.DataFrame()
-            
-            # Convert date column to datetime
-            user_data['Date_of_Drive'] = pd.to_datetime(user_data['Date_of_Drive'], errors='coerce')
-            
-            # Convert numeric columns to float
-            numeric_columns = ['Initial_Mileage_KM', 'Final_Mileage_KM', 'Distance_Driven_KM']
-            for col in numeric_columns:
-                if col in user_data.columns:
-                    user_data[col] = pd.to_numeric(user_data[col], errors='coerce')
-            
-            # Remove rows with invalid dates
-            user_data = user_data.dropna(subset=['Date_of_Drive'])
+                records = _records_from_values(_self.mileage_worksheet.get_all_values(), MILEAGE_HEADERS)
             
-            # Sort by date
-            user_data = user_data.sort_values('Date_of_Drive')
-            
-            return user_data
+            return _user_mileage_frame(records, username)
             
         except Exception as e:
             raise Exception(f"Failed to get user data: {str(e)}")
     
-    @st.cache_data(ttl=900, show_spinner=False)  # 15 minute cache for personnel status (faster updates)
+    @st.cache_data(ttl=120, show_spinner=False)  # 2 minute cache - one batchGet per refresh
     def get_all_personnel_status(_self):
         """Get currency status for all personnel across both vehicle types"""
         try:
-            all_personnel = []
-            
-            # Get Terrex personnel
-            try:
-                terrex_records = _self.terrex_worksheet.get_all_records()
-            except:
-                terrex_values = _self.terrex_worksheet.get_all_values()
-                terrex_records = []
-                if len(terrex_values) > 1:
-                    headers = terrex_values[0]
-                    for row in terrex_values[1:]:
-                        record = {}
-                        for i, header in enumerate(headers):
-                            if i < len(row):
-                                record[header] = row[i]
-                        terrex_records.append(record)
-            
-            for record in terrex_records:
-                username = record.get('Username', '').strip()
-                if not username:
-                    continue
-                
-                # Check if qualified
-                qualification = record.get('Qualification', '').strip()
-                qual_date = record.get('Qualification Date', '').strip()
-                
-                if qualification and qual_date:
-                    personnel_data = {
-                        'username': username,
-                        'rank': record.get('Rank', ''),
-                        'name': record.get('Name', ''),
-                        'platoon': record.get('Platoon', ''),
-                        'sub_unit': record.get('Sub Unit', ''),
-                        'vehicle_type': 'Terrex',
-                        'qualification': qualification,
-                        'qual_date': qual_date,
-                        'currency_status': record.get('Currency Maintained', 'N/A'),
-                        'distance_3_months': float(record.get('Distance in Last 3 Months', 0) or 0),
-                        'last_drive_date': record.get('Last Driven Date', 'N/A'),
-                        'expiry_date': record.get('Lapsing Date', 'N/A'),
-                        'days_to_expiry': record.get('Days to Expiry', 'N/A')
-                    }
-                    all_personnel.append(personnel_data)
-            
-            # Get Belrex personnel
-            try:
-                belrex_records = _self.belrex_worksheet.get_all_records()
-            except:
-                belrex_values = _self.belrex_worksheet.get_all_values()
-                belrex_records = []
-                if len(belrex_values) > 1:
-                    headers = belrex_values[0]
-                    for row in belrex_values[1:]:
-                        record = {}
-                        for i, header in enumerate(headers):
-                            if i < len(row):
-                                record[header] = row[i]
-                        belrex_records.append(record)
+            # Both tracker sheets in a single values.batchGet round trip
+            response = _self.spreadsheet.values_batch_get([
+                gspread.utils.absolute_range_name(_self.terrex_worksheet.title),
+                gspread.utils.absolute_range_name(_self.belrex_worksheet.title)
+            ])
+            value_ranges = response.get('valueRanges', [])
+            terrex_values, belrex_values = [
+                value_ranges[i].get('values', []) if i < len(value_ranges) else [] for i in range(2)
+            ]
             
-            for record in belrex_records:
-                username = record.get('Username', '').strip()
-                if not username:
-                    continue
-                
-                # Check if qualified
-                qualification = record.get('Qualification', '').strip()
-                qual_date = record.get('Qualification Date', '').strip()
-                
-                if qualification and qual_date:
-                    personnel_data = {
-                        'username': username,
-                        'rank': record.get('Rank', ''),
-                        'name': record.get('Name', ''),
-                        'platoon': record.get('Platoon', ''),
-                        'sub_unit': record.get('Sub Unit', ''),
-                        'vehicle_type': 'Belrex',
-                        'qualification': qualification,
-                        'qual_date': qual_date,
-                        'currency_status': record.get('Currency Maintained', 'N/A'),
-                        'distance_3_months': float(record.get('Distance in Last 3 Months', 0) or 0),
-                        'last_drive_date': record.get('Last Driven Date', 'N/A'),
-                        'expiry_date': record.get('Lapsing Date', 'N/A'),
-                        'days_to_expiry': record.get('Days to Expiry', 'N/A')
-                    }
-                    all_personnel.append(personnel_data)
+            all_personnel = []
+            for vehicle_type, values in (('Terrex', terrex_values), ('Belrex', belrex_values)):
+                for record in _records_from_values(values):
+                    username = record.get('Username', '').strip()
+                    if not username:
+                        continue
+                    
+                    # Check if qualified
+                    qualification = record.get('Qualification', '').strip()
+                    qual_date = record.get('Qualification Date', '').strip()
+                    
+                    if qualification and qual_date:
+                        personnel_data = {
+                            'username': username,
+                            'rank': record.get('Rank', ''),
+                            'name': record.get('Name', ''),
+                            'platoon': record.get('Platoon', ''),
+                            'sub_unit': record.get('Sub Unit', ''),
+                            'vehicle_type': vehicle_type,
+                            'qualification': qualification,
+                            'qual_date': qual_date,
+                            'currency_status': record.get('Currency Maintained', 'N/A'),
+                            'distance_3_months': _to_float(record.get('Distance in Last 3 Months')),
+                            'last_drive_date': record.get('Last Driven Date', 'N/A'),
+                            'expiry_date': record.get('Lapsing Date', 'N/A'),
+                            'days_to_expiry': record.get('Days to Expiry', 'N/A')
+                        }
+                        all_personnel.append(personnel_data)
             
             return all_personnel
             
@@ -800,48 +880,8 @@ class SheetsManager:
         tracker_data = {'terrex': None, 'belrex': None}
         
         try:
-            # Get Terrex data
-            try:
-                terrex_records = _self.terrex_worksheet.get_all_records()
-            except:
-                # Handle duplicate headers by using raw values
-                terrex_values = _self.terrex_worksheet.get_all_values()
-                terrex_records = []
-                if len(terrex_values) > 1:
-                    headers = terrex_values[0]
-                    for row in terrex_values[1:]:
-                        record = {}
-                        for i, header in enumerate(headers):
-                            if i < len(row):
-                                record[header] = row[i]
-                        terrex_records.append(record)
-            
-            for record in terrex_records:
-                if record.get('Username') == username:
-                    tracker_data['terrex'] = record
-                    break
-            
-            # Get Belrex data
-            try:
-                belrex_records = _self.belrex_worksheet.get_all_records()
-            except:
-                # Handle duplicate headers by using raw values
-                belrex_values = _self.belrex_worksheet.get_all_values()
-                belrex_records = []
-                if len(belrex_values) > 1:
-                    headers = belrex_values[0]
-                    for row in belrex_values[1:]:
-                        record = {}
-                        for i, header in enumerate(headers):
-                            if i < len(row):
-                                record[header] = row[i]
-                        belrex_records.append(record)
-            
-            for record in belrex_records:
-                if record.get('Username') == username:
-                    tracker_data['belrex'] = record
-                    break
-                    
+            tracker_data['terrex'] = _find_tracker_record(_read_records(_self.terrex_worksheet), username)
+            tracker_data['belrex'] = _find_tracker_record(_read_records(_self.belrex_worksheet), username)
         except Exception as e:
             print(f"Warning: Failed to get tracker data: {str(e)}")
         
@@ -0,0 +1,104 @@
+import json
+
+import pytest
+
+import auth
+
+
+@pytest.fixture(autouse=True)
+def credentials_dir(tmp_path, monkeypatch):
+    """Run each test against its own credentials.json with cheap scrypt parameters"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(auth, "SCRYPT_N", 2 ** 10)
+    monkeypatch.setattr(auth, "_credentials_cache", {'mtime': None, 'credentials': None})
+    return tmp_path
+
+
+def write_credentials(credentials):
+    with open('credentials.json', 'w') as f:
+        json.dump(credentials, f)
+
+
+def read_credentials():
+    with open('credentials.json') as f:
+        return json.load(f)
+
+
+def test_scrypt_round_trip():
+    entry = {'password': auth.hash_password_scrypt("hunter22"), 'hash_alg': 'scrypt'}
+    assert auth.verify_password(entry, "hunter22") == (True, False)
+    assert auth.verify_password(entry, "wrong") == (False, False)
+
+
+def test_scrypt_hashes_are_salted():
+    assert auth.hash_password_scrypt("hunter22") != auth.hash_password_scrypt("hunter22")
+
+
+def test_malformed_scrypt_entry_is_rejected():
+    assert auth.verify_password({'password': 'not-a-hash', 'hash_alg': 'scrypt'}, "x") == (False, False)
+
+
+def test_legacy_sha256_entries_need_rehash():
+    legacy = auth.hash_password("secret123")
+    assert auth.verify_password(legacy, "secret123") == (True, True)
+    assert auth.verify_password({'password': legacy}, "secret123") == (True, True)
+    assert auth.verify_password(legacy, "wrong")[0] is False
+
+
+def test_login_upgrades_legacy_hash_to_scrypt():
+    write_credentials({'trooper': auth.hash_password("secret123")})
+
+    assert auth.authenticate_user('trooper', "secret123")
+
+    entry = read_credentials()['trooper']
+    assert entry['hash_alg'] == 'scrypt'
+    assert auth.verify_password(entry, "secret123") == (True, False)
+    assert auth.authenticate_user('trooper', "secret123")
+
+
+def test_failed_login_leaves_legacy_hash():
+    legacy = auth.hash_password("secret123")
+    write_credentials({'trooper': legacy})
+
+    assert not auth.authenticate_user('trooper', "wrong")
+    assert read_credentials()['trooper'] == legacy
+
+
+def test_update_credentials_rereads_and_skips_unchanged_writes():
+    write_credentials({'alice': auth.hash_password("pw")})
+    # Another writer's change lands after this process cached the file
+    auth._cached_credentials()
+    write_credentials({'alice': auth.hash_password("pw"), 'bob': auth.hash_password("pw")})
+
+    assert auth.update_credentials(lambda creds: creds.pop('alice', None) is not None)
+    assert set(read_credentials()) == {'bob'}
+
+    assert not auth.update_credentials(lambda creds: False)
+    assert set(read_credentials()) == {'bob'}
+
+
+def test_change_password():
+    write_credentials({'alice': auth.hash_password("oldpass")})
+
+    assert auth.change_password('alice', "wrong", "newpass1") == (False, "Current password is incorrect")
+    assert auth.change_password('alice', "oldpass", "short")[0] is False
+
+    ok, _ = auth.change_password('alice', "oldpass", "newpass1")
+    assert ok
+    assert auth.authenticate_user('alice', "newpass1")
+    assert not auth.authenticate_user('alice', "oldpass")
+
+
+def test_rehash_does_not_resurrect_a_concurrently_deleted_user(monkeypatch):
+    write_credentials({'trooper': auth.hash_password("secret123"), 'admin': auth.hash_password("pw")})
+    real_update = auth.update_credentials
+
+    def delete_then_update(change):
+        # An admin delete lands between password verification and the rehash write
+        write_credentials({'admin': auth.hash_password("pw")})
+        return real_update(change)
+
+    monkeypatch.setattr(auth, "update_credentials", delete_then_update)
+
+    assert auth.authenticate_user('trooper', "secret123")
+    assert set(read_credentials()) == {'admin'}
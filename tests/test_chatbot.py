@@ -0,0 +1,98 @@
+import pytest
+
+pytest.importorskip("streamlit")
+np = pytest.importorskip("numpy")
+
+from chatbot import MSCSafetyBot
+
+
+class SheetsData:
+    """Minimal stand-in exposing the two sheet readers prepare_knowledge_base uses"""
+
+    def __init__(self, infographics, pointers):
+        self.infographics = infographics
+        self.pointers = pointers
+
+    def get_safety_infographics(self):
+        return self.infographics
+
+    def get_safety_pointers(self):
+        return self.pointers
+
+
+INFOGRAPHICS = [
+    {'Title': 'Terrex reversing', 'Description': 'Use a guide when reversing the Terrex', 'Tags': 'reversing'},
+    {'Title': 'Hydration', 'Description': 'Drink water before long drives', 'Tags': 'health'},
+]
+
+POINTERS = [
+    {'Category': 'Night convoy spacing', 'Reflection': 'Gaps closed up at night',
+     'Recommendation': 'Keep two vehicle lengths at night', 'Submitter': 'Convoy'},
+    {'Category': 'Belrex blind spot', 'Reflection': 'Missed a ground guide',
+     'Recommendation': 'Check mirrors before moving off', 'Submitter': 'Movement'},
+]
+
+
+@pytest.fixture
+def bot():
+    bot = MSCSafetyBot()
+    assert bot.prepare_knowledge_base(SheetsData(INFOGRAPHICS, POINTERS)) == 4
+    return bot
+
+
+def loop_scores(bot, query):
+    """Reference per-document scoring, as retrieve_relevant_docs computed it before vectorization"""
+    query_lower = query.lower()
+    keywords = query_lower.replace('?', ' ').split()
+    query_words = set(keywords)
+    scores = []
+    for doc in bot.knowledge_base:
+        words = doc['_word_set']
+        keyword_score = sum(1 for keyword in keywords if keyword in words)
+        overlap = len(query_words & words)
+        similarity = overlap / (len(query_words) + len(words) - overlap) if query_words and words else 0.0
+        boost = 0
+        if any(term in query_lower for term in ['terrex', 'belrex']) and any(term in doc['_content_lower'] for term in ['terrex', 'belrex']):
+            boost += 0.3
+        if any(term in query_lower for term in ['safety', 'pointer', 'recommendation']) and doc['type'] == 'safety_pointer':
+            boost += 0.2
+        if any(term in query_lower for term in ['infographic', 'image', 'visual']) and doc['type'] == 'infographic':
+            boost += 0.2
+        scores.append((keyword_score * 0.4) + (similarity * 0.4) + boost)
+    return scores
+
+
+@pytest.mark.parametrize("query", [
+    "terrex reversing",
+    "night convoy safety",
+    "belrex pointer recommendation",
+    "show me an infographic",
+    "reversing reversing guide",
+])
+def test_scores_match_per_document_loop(bot, query):
+    expected = loop_scores(bot, query)
+    ranked = sorted(
+        ((score, i) for i, score in enumerate(expected) if score > 0.1),
+        key=lambda item: item[0], reverse=True
+    )[:3]
+
+    results = bot.retrieve_relevant_docs(query)
+
+    assert [r['doc'] for r in results] == [bot.knowledge_base[i] for _, i in ranked]
+    assert [r['similarity'] for r in results] == pytest.approx([score for score, _ in ranked])
+
+
+def test_repeated_keywords_count_each_time(bot):
+    single = bot.retrieve_relevant_docs("guide")[0]['similarity']
+    repeated = bot.retrieve_relevant_docs("guide guide")[0]['similarity']
+    assert repeated > single
+
+
+def test_unmatched_query_returns_nothing(bot):
+    assert bot.retrieve_relevant_docs("zzzz qqqq") == []
+
+
+def test_empty_knowledge_base():
+    bot = MSCSafetyBot()
+    assert bot.prepare_knowledge_base(SheetsData([], [])) == 0
+    assert bot.retrieve_relevant_docs("terrex") == []
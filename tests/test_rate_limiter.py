@@ -0,0 +1,77 @@
+import pytest
+
+import rate_limiter
+from redis_circuit import RedisCircuit
+
+
+@pytest.fixture(autouse=True)
+def fresh_limiter(monkeypatch):
+    """Isolate each test from module-level limiter state"""
+    monkeypatch.setattr(rate_limiter, "_local_windows", {})
+    monkeypatch.setattr(rate_limiter, "_last_sweep", 0.0)
+    monkeypatch.setattr(rate_limiter, "_redis_circuit", RedisCircuit("rate limiter"))
+    monkeypatch.delenv("REDIS_URL", raising=False)
+
+
+def test_local_window_allows_up_to_limit():
+    results = [rate_limiter.allow_request("alice", window_seconds=60, limit=3) for _ in range(4)]
+    assert results == [True, True, True, False]
+
+
+def test_limits_are_per_user():
+    for _ in range(3):
+        rate_limiter.allow_request("alice", window_seconds=60, limit=3)
+    assert rate_limiter.allow_request("bob", window_seconds=60, limit=3)
+
+
+def test_local_window_rolls_forward():
+    key = "{u:alice}:rw"
+    assert rate_limiter._local_allow(key, 100.0, 10, 2)
+    assert rate_limiter._local_allow(key, 101.0, 10, 2)
+    assert not rate_limiter._local_allow(key, 105.0, 10, 2)
+    # The first request has left the window
+    assert rate_limiter._local_allow(key, 110.5, 10, 2)
+
+
+def test_idle_windows_are_swept():
+    rate_limiter._local_allow("{u:alice}:rw", 100.0, 10, 5)
+    rate_limiter._local_allow("{u:bob}:rw", 100.0 + rate_limiter.LOCAL_SWEEP_SECONDS, 10, 5)
+    assert set(rate_limiter._local_windows) == {"{u:bob}:rw"}
+
+
+def test_redis_failure_falls_back_and_opens_circuit(monkeypatch):
+    calls = []
+
+    def broken_script():
+        calls.append(1)
+        raise ConnectionError("redis down")
+
+    monkeypatch.setattr(rate_limiter, "_get_redis_script", broken_script)
+
+    assert rate_limiter.allow_request("alice", window_seconds=60, limit=2)
+    assert rate_limiter.allow_request("alice", window_seconds=60, limit=2)
+    assert not rate_limiter.allow_request("alice", window_seconds=60, limit=2)
+    # Only the first call paid for the failing Redis round trip
+    assert len(calls) == 1
+
+
+def test_redis_outage_is_logged_once(monkeypatch, caplog):
+    def broken_script():
+        raise ConnectionError("redis down")
+
+    monkeypatch.setattr(rate_limiter, "_get_redis_script", broken_script)
+    monkeypatch.setattr(rate_limiter, "_redis_circuit", RedisCircuit("rate limiter", retry_seconds=0))
+
+    for _ in range(3):
+        rate_limiter.allow_request("alice", window_seconds=60, limit=10)
+
+    warnings = [r for r in caplog.records if r.levelname == "WARNING"]
+    assert len(warnings) == 1
+
+
+def test_actions_are_limited_per_login_session():
+    for _ in range(2):
+        assert rate_limiter.allow_action("alice", "tab-1", window_seconds=60, limit=2)
+    assert not rate_limiter.allow_action("alice", "tab-1", window_seconds=60, limit=2)
+    # Another tab or device of the same account keeps its own budget
+    assert rate_limiter.allow_action("alice", "tab-2", window_seconds=60, limit=2)
@@ -0,0 +1,103 @@
+from types import SimpleNamespace
+
+import pytest
+
+import session_store
+from redis_circuit import RedisCircuit
+
+
+@pytest.fixture(autouse=True)
+def fresh_store(monkeypatch):
+    """Isolate each test from module-level session state"""
+    monkeypatch.setattr(session_store, "_local_sessions", {})
+    monkeypatch.setattr(session_store, "_last_sweep", 0.0)
+    monkeypatch.setattr(session_store, "_redis_circuit", RedisCircuit("session store"))
+    monkeypatch.delenv("REDIS_URL", raising=False)
+
+
+def test_create_and_lookup_session():
+    token, expires_at = session_store.create_session("alice")
+    assert session_store.get_session_user(token) == "alice"
+    assert expires_at > 0
+
+
+def test_unknown_and_empty_tokens():
+    assert session_store.get_session_user("nope") is None
+    assert session_store.get_session_user(None) is None
+    assert session_store.refresh_session("") == (None, None)
+
+
+def test_refresh_slides_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(session_store.time, "time", lambda: now[0])
+
+    token, expires_at = session_store.create_session("alice")
+    now[0] += 60
+    username, new_expiry = session_store.refresh_session(token)
+
+    assert username == "alice"
+    assert new_expiry == expires_at + 60
+
+
+def test_expired_session_is_rejected(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(session_store.time, "time", lambda: now[0])
+
+    token, _ = session_store.create_session("alice")
+    now[0] += session_store.SESSION_TTL_SECONDS
+
+    assert session_store.get_session_user(token) is None
+    assert session_store.refresh_session(token) == (None, None)
+    assert token not in session_store._local_sessions
+
+
+def test_delete_session():
+    token, _ = session_store.create_session("alice")
+    session_store.delete_session(token)
+    assert session_store.get_session_user(token) is None
+
+
+def test_expired_sessions_are_swept(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(session_store.time, "time", lambda: now[0])
+
+    abandoned, _ = session_store.create_session("alice")
+    now[0] += session_store.SESSION_TTL_SECONDS + session_store.LOCAL_SWEEP_SECONDS
+    live, _ = session_store.create_session("bob")
+
+    assert set(session_store._local_sessions) == {live}
+
+
+class _UnreachableRedis:
+    """Client whose every command fails the way a dead Redis server does"""
+    commands = 0
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        return cls()
+
+    def register_script(self, script):
+        return self._fail
+
+    def _fail(self, *args, **kwargs):
+        type(self).commands += 1
+        raise ConnectionError("redis down")
+
+    set = get = delete = _fail
+
+
+def test_redis_failure_falls_back_to_local_store(monkeypatch, caplog):
+    monkeypatch.setenv("REDIS_URL", "redis://unreachable:6379/0")
+    monkeypatch.setattr(session_store, "redis", SimpleNamespace(Redis=_UnreachableRedis))
+    monkeypatch.setattr(session_store, "_redis_client", None)
+    _UnreachableRedis.commands = 0
+
+    token, _ = session_store.create_session("alice")
+    assert session_store.get_session_user(token) == "alice"
+    assert session_store.refresh_session(token)[0] == "alice"
+    session_store.delete_session(token)
+    assert session_store.get_session_user(token) is None
+
+    # The failed create opened the circuit, so later calls never sent a command to Redis
+    assert _UnreachableRedis.commands == 1
+    assert len([r for r in caplog.records if r.levelname == "WARNING"]) == 1